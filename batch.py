@@ -0,0 +1,314 @@
+import argparse
+import threading
+
+from datetime import date
+from functools import partial
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any
+
+from data_processor import (
+    DataPoint, MonthSeries, RE_RETRIEVE_RATIO, load_cache, save_cache,
+    first_missing_day, extend_data)
+from profiler import PROFILER
+from table_view import TableView, Cell, CellAlignment, StreamFormat
+from util import balance_color, WIDTH, PRECISION, print_err, print_note
+
+# Command line options (dest: name) handled only in single meter mode
+UNSUPPORTED_OPTIONS = {
+    "date_from": "--from",
+    "date_to": "--to",
+    "compare": "--compare",
+    "group": "--group",
+    "tariffs": "--tariffs",
+    "hours": "--hours",
+    "repair": "--repair",
+    "import_files": "--import",
+    "rebuild": "--rebuild",
+}
+
+
+@dataclass
+class MeterConfig:
+    """Single meter from 'meters' list in the configuration file.
+
+    Args:
+        meter_id (str): Meter identifier (from eLicznik)
+        username (str): Account (login) the meter belongs to
+        password (str): Password to the account
+        installation_date (date): Since when renewable energy is available
+        name (str): Name shown in the report (meter_id by default)
+        cache_file (str): Cache file (cache_<meter_id>.csv by default)
+    """
+    meter_id: str
+    username: str
+    password: str
+    installation_date: date
+    name: str
+    cache_file: str | None = None
+
+    @property
+    def cache_path(self) -> str:
+        if self.cache_file is not None:
+            return self.cache_file
+        return f"cache_{self.meter_id}.csv"
+
+
+def parse_meters(config: dict[str, Any]) -> list[MeterConfig]:
+    """Read meters list, missing credentials are taken from the top level"""
+    meters = []
+    try:
+        for meter in config["meters"]:
+            meters.append(MeterConfig(
+                meter_id=str(meter["meter_id"]),
+                username=meter.get("username", config.get("username")),
+                password=meter.get("password", config.get("password")),
+                installation_date=date.fromisoformat(
+                    meter["installation_date"]),
+                name=str(meter.get("name", meter["meter_id"])),
+            ))
+    except KeyError as e:
+        print_err(f"Key {e} not found in 'meters' configuration")
+    except ValueError as e:
+        print_err(f"[Error] {e}")
+
+    for meter in meters:
+        if meter.username is None or meter.password is None:
+            print_err(f"No credentials for meter {meter.meter_id}")
+
+    return meters
+
+
+class SessionPool():
+    """One logged in session per account.
+
+    Selected meter is kept by the service (per session), so meters of the
+    same account have to be processed one by one (see account_lock).
+    """
+    def __init__(self, extra_headers: list[dict[str, str]],
+                 use_session_cache: bool) -> None:
+        self.extra_headers = extra_headers
+        self.use_session_cache = use_session_cache
+        self._sessions: dict[str, Any] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def account_lock(self, username: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(username, threading.Lock())
+
+    def get(self, username: str, password: str) -> Any:
+        """Logged in session (account lock should be held by the caller).
+
+        Kept session is checked first (it expires after a while,
+        e.g. in daemon mode), if it's not valid anymore it's logged in again.
+        """
+        from tauron import login_to_tauron, is_session_valid
+        session = self._sessions.get(username)
+        if session is not None and not is_session_valid(session):
+            print_note(f"Session of {username} expired.")
+            self.invalidate(username)
+            session = None
+
+        if session is None:
+            session = self._sessions[username] = login_to_tauron(
+                username, password, self.extra_headers,
+                self.use_session_cache)
+        return session
+
+    def invalidate(self, username: str) -> None:
+        """Log in again next time (e.g. when no data were downloaded)"""
+        self._sessions.pop(username, None)
+        if self.use_session_cache:
+            from session_cache import drop_session
+            drop_session(username)
+
+
+def update_meter(meter: MeterConfig, pool: SessionPool | None,
+                 shared_account: bool,
+                 args: argparse.Namespace, options: dict[str, Any],
+                 date_today: date,
+                 data: MonthSeries | None = None) -> MonthSeries:
+    """Download days missing in data (loaded from cache if not provided)"""
+    if data is None:
+        data = MonthSeries()
+        if args.use_cache:
+            with PROFILER.phase("cache_load"):
+                data = load_cache(meter.cache_path)
+
+    iter_date = first_missing_day(data, meter.installation_date)
+    if pool is None or args.offline or iter_date >= date_today:
+        return data
+
+    from tauron import gather_and_parse_data_from_tauron, select_meter
+
+    store = None
+    on_month_data = None
+    if options["daily_store"] is not None:
+        from daily_store import open_store, save_monthly_data
+        # NOTE: SQLite connection can't be shared between threads
+        store = open_store(options["daily_store"])
+        on_month_data = partial(save_monthly_data, store, meter.meter_id)
+
+    try:
+        with pool.account_lock(meter.username):
+            session = pool.get(meter.username, meter.password)
+            if shared_account:
+                select_meter(session, meter.meter_id)
+
+            def checkpoint(new_data: list[DataPoint]) -> None:
+                extend_data(data, new_data)
+                if args.use_cache:
+                    with PROFILER.phase("cache_save"):
+                        save_cache(data, meter.cache_path, quiet=True)
+
+            with PROFILER.phase("fetch"):
+                new_data = gather_and_parse_data_from_tauron(
+                    session, meter.meter_id, iter_date, date_today,
+                    meter.installation_date, True, options["workers"],
+                    options["coalesce"], on_month_data, checkpoint)
+            if not new_data:
+                # NOTE: Session might be rejected even if it looks valid
+                pool.invalidate(meter.username)
+    finally:
+        # NOTE: Daemon updates meters repeatedly, connections aren't kept
+        if store is not None:
+            store.close()
+
+    print_note(f"Data for meter {meter.name} updated.")
+    return data
+
+
+def fetch_options(config: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "workers": int(config.get("workers", 1)),
+        "coalesce": bool(config.get("coalesce_requests", False)),
+        "daily_store": config.get("daily_store", None),
+    }
+
+
+def configure_fetching(config: dict[str, Any],
+                       options: dict[str, Any]) -> SessionPool:
+    """Set up request limit and response cache, create session pool"""
+    from tauron import limit_concurrent_requests, enable_response_cache
+
+    # All meters share the same limit of requests in flight
+    limit_concurrent_requests(options["workers"])
+    if config.get("response_cache", None) is not None:
+        enable_response_cache(
+            config["response_cache"],
+            float(config.get("response_cache_ttl", 3600)),
+            int(config.get("response_cache_size_mb", 64)) * 1024 * 1024)
+
+    return SessionPool(
+        config.get("extra_headers", []),
+        bool(config.get("session_cache", True)))
+
+
+def check_options(args: argparse.Namespace, mode: str) -> None:
+    """Options of single meter mode are not supported for many meters"""
+    used = [option for dest, option in UNSUPPORTED_OPTIONS.items()
+            if getattr(args, dest) not in (None, False)]
+    if used:
+        print_err(f"{', '.join(used)} {'is' if len(used) == 1 else 'are'} "
+                  f"not supported in {mode} mode.")
+
+
+def run_batch(config: dict[str, Any], args: argparse.Namespace,
+              date_today: date) -> None:
+    """Update all configured meters and show one combined report"""
+    check_options(args, "batch")
+    meters = parse_meters(config)
+    options = fetch_options(config)
+
+    if not args.use_cache and args.offline:
+        print_note("There are no data to process. Use cache or online mode.")
+        exit(0)
+
+    pool = None
+    if not args.offline:
+        pool = configure_fetching(config, options)
+
+    accounts = [meter.username for meter in meters]
+
+    print_note(f"Processing {len(meters)} meters...")
+    with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+        futures = [executor.submit(
+            update_meter, meter, pool, accounts.count(meter.username) > 1,
+            args, options, date_today) for meter in meters]
+        # NOTE: re-raises errors (and exits) from workers
+        all_data = [future.result() for future in futures]
+
+    print_report(meters, all_data, args)
+
+
+def print_report(meters: list[MeterConfig], all_data: list[MonthSeries],
+                 args: argparse.Namespace) -> None:
+    if args.data_year is not None:
+        print_note(f"# Data for {args.data_year} year only! #")
+
+    if args.format == "json":
+        table = TableView()
+    else:
+        table = TableView(
+            stream=args.output,
+            stream_format=StreamFormat(args.format or "table"))
+    table.set_header([
+        ("meter", "Meter"),
+        ("date", "Date"),
+        ("usage", "Usage"),
+        ("renewable_energy", "RE"),
+        ("renewable_energy_for_use", "RE 2 use"),
+        ("days_with_positive_balance", "(+) days"),
+        ("monthly_balance", "Balance")])
+
+    totals: list[tuple[str, float, float]] = []
+    for idx, (meter, data) in enumerate(zip(meters, all_data)):
+        if idx > 0:
+            table.add_divider()
+
+        # If specific year is selected skip others
+        if args.data_year is not None:
+            data = data.year(args.data_year)
+
+        usage = oze = 0.0
+        for dp in data:
+            table.add_row([
+                meter.name,
+                f"{dp.month:%Y-%m}",
+                f"{dp.usage:.{PRECISION}f}",
+                f"{dp.oze:.{PRECISION}f}",
+                f"{dp.oze*RE_RETRIEVE_RATIO:.{PRECISION}f}",
+                dp.positive_days,
+                Cell(dp.balance, "balance", CellAlignment.RIGHT)
+            ])
+            usage += dp.usage
+            oze += dp.oze
+        totals.append((meter.name, usage, oze))
+
+    if args.format == "json":
+        print(table.to_json(), file=args.output)
+    else:
+        table.close()
+
+    if args.format is not None:
+        # No summary if we want different format
+        return
+
+    for name, usage, oze in totals:
+        balance = oze * RE_RETRIEVE_RATIO - usage
+        print(f"> {name:<{WIDTH}}  usage: {usage:{WIDTH}.{PRECISION}f} kWh, "
+              f"RE: {oze:{WIDTH}.{PRECISION}f} kWh, "
+              f"balance: {balance_color(balance, WIDTH, 'kWh')}",
+              file=args.output)
+
+    total_usage = sum(usage for _, usage, _ in totals)
+    total_oze = sum(oze for _, _, oze in totals)
+    print(f"> Total usage:  {total_usage:{WIDTH}.{PRECISION}f} kWh",
+          file=args.output)
+    print(f"> Total RE:     {total_oze:{WIDTH}.{PRECISION}f} kWh",
+          file=args.output)
+    print(f"> Balance:      "
+          f"{balance_color(total_oze * RE_RETRIEVE_RATIO - total_usage, WIDTH, 'kWh')}",
+          file=args.output)
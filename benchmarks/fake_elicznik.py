@@ -0,0 +1,181 @@
+"""Local stand-in for Tauron login service and eLicznik API.
+
+Serves synthetic (deterministic) data for any meter and date range, with
+configurable latency and error rate, so the fetching code can be run and
+measured without the real service.
+
+    python3 benchmarks/fake_elicznik.py [--port PORT] [--latency-ms MS]
+
+Use FakeELicznik.patch_tauron() to point `tauron` module at the server.
+"""
+import math
+import time
+import json
+import random
+import argparse
+import threading
+
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LOGIN_PATH = "/login"
+API_PATH = "/energia/api"
+SELECT_METER_PATH = "/ustaw_punkt"
+SESSION_COOKIE = "fake-elicznik-session"
+
+
+@lru_cache(maxsize=None)
+def synthetic_value(day: date, data_type: str, hour: int | None = None
+                    ) -> float:
+    """Seasonal, deterministic daily (or hourly) energy value"""
+    season = math.cos((day.timetuple().tm_yday - 172) / 365 * 2 * math.pi)
+    noise = random.Random(
+        f"{day.toordinal()}{data_type}{hour}").uniform(0.8, 1.2)
+    if data_type == "oze":
+        daily = max(0.0, 10 + 12 * season) * noise
+    else:
+        daily = (12 - 4 * season) * noise
+
+    if hour is None:
+        return round(daily, 3)
+    if data_type == "oze":
+        return round(daily * max(0.0, math.sin((hour - 5) / 14 * math.pi))
+                     / 8.9, 3)
+    return round(daily / 24, 3)
+
+
+class FakeELicznik:
+    def __init__(self, port: int = 0, latency_ms: float = 0.0,
+                 error_rate: float = 0.0, today: date | None = None) -> None:
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.today = today or date.today()
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> 'FakeELicznik':
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def patch_tauron(self) -> None:
+        import tauron
+        tauron.LOGIN_URL = f"{self.url}{LOGIN_PATH}"
+        tauron.ELICZNIK_URL = self.url
+        tauron.DATA_API_URL = f"{self.url}{API_PATH}"
+        tauron.SELECT_METER_URL = f"{self.url}{SELECT_METER_PATH}"
+
+    def data(self, body: dict[str, str]) -> dict:
+        first = datetime.strptime(body["from"], "%d.%m.%Y").date()
+        last = datetime.strptime(body["to"], "%d.%m.%Y").date()
+        hourly = body.get("profile") == "full+time"
+
+        values: list[float | None] = []
+        day = first
+        while day <= last:
+            if hourly:
+                values.extend(
+                    synthetic_value(day, body["type"], hour)
+                    if day < self.today else None for hour in range(24))
+            else:
+                values.append(synthetic_value(day, body["type"])
+                              if day < self.today else None)
+            day += timedelta(days=1)
+
+        return {"data": {
+            "values": values,
+            "sum": round(sum(v for v in values if v is not None), 3),
+            "tariff": "G11",
+        }}
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep connections alive
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _reply(self, status: int, payload: bytes = b"",
+                       headers: dict[str, str] = {}) -> None:
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                with fake._lock:
+                    fake.requests += 1
+                    fake.bytes_sent += len(payload)
+
+            def _delay_or_fail(self) -> bool:
+                time.sleep(fake.latency)
+                if random.random() < fake.error_rate:
+                    self._reply(500)
+                    return True
+                return False
+
+            def do_GET(self) -> None:
+                if self._delay_or_fail():
+                    return
+                if SESSION_COOKIE in self.headers.get("Cookie", ""):
+                    self._reply(200, b"OK")
+                else:
+                    self._reply(302, headers={"Location": LOGIN_PATH})
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                body = {key: values[0] for key, values in parse_qs(
+                    self.rfile.read(length).decode()).items()}
+                if self._delay_or_fail():
+                    return
+
+                if self.path == LOGIN_PATH:
+                    self._reply(200, b"OK", {
+                        "Set-Cookie": f"{SESSION_COOKIE}=1; Path=/"})
+                elif self.path == SELECT_METER_PATH:
+                    self._reply(200, b"OK")
+                elif self.path == API_PATH:
+                    self._reply(200, json.dumps(fake.data(body)).encode(),
+                                {"Content-Type": "application/json"})
+                else:
+                    self._reply(404)
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeELicznik(args.port, args.latency_ms, args.error_rate)
+    print(f"Serving fake eLicznik on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
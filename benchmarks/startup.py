@@ -0,0 +1,99 @@
+"""Cold start benchmark of the offline (cache only) path.
+
+Runs `tauron_statistics.py --offline` in a fresh interpreter several times
+(with a synthetic config and cache) and reports wall time. It also checks
+that network related modules are not imported.
+
+    python3 benchmarks/startup.py [-n RUNS] [--max-ms LIMIT]
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from time import perf_counter
+from datetime import date
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_DIR, "tauron_statistics.py")
+
+# Modules that shouldn't be loaded when nothing is downloaded
+UNWANTED_MODULES = ("requests", "simplejson", "dateutil", "urllib3")
+
+CONFIG = """meter_id: 1
+username: "user"
+password: "password"
+price: 1.00
+fixed_cost: 23.45
+installation_date: "2020-01-01"
+extra_headers: []
+"""
+
+
+def prepare_workdir(path: str, years: int) -> None:
+    with open(os.path.join(path, "config.yml"), "w") as config_file:
+        config_file.write(CONFIG)
+
+    with open(os.path.join(path, "cache.csv"), "w") as csv_file:
+        writer = csv.writer(csv_file, delimiter=';')
+        for idx in range(years * 12):
+            month = date(2020 + idx // 12, idx % 12 + 1, 1)
+            writer.writerow([month.isoformat(), 300.0, 250.0, -100.0, 28, 5])
+
+
+def imported_modules(workdir: str) -> set[str]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", SCRIPT, "--offline"],
+        cwd=workdir, capture_output=True, text=True)
+    return {line.split("|")[-1].strip().split(".")[0]
+            for line in result.stderr.splitlines()
+            if line.startswith("import time:")}
+
+
+def measure(workdir: str, runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run(
+            [sys.executable, SCRIPT, "--offline"], cwd=workdir,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((perf_counter() - start) * 1000)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    parser.add_argument('--years', type=int, default=5,
+                        help="How many years of data are kept in cache.")
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help="Fail if median start time exceeds the limit.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        prepare_workdir(workdir, args.years)
+        unwanted = sorted(imported_modules(workdir) & set(UNWANTED_MODULES))
+        timings = measure(workdir, args.runs)
+
+    result = {
+        "benchmark": "offline_startup",
+        "runs": args.runs,
+        "years": args.years,
+        "min_ms": round(min(timings), 2),
+        "median_ms": round(statistics.median(timings), 2),
+        "max_ms": round(max(timings), 2),
+        "unwanted_imports": unwanted,
+    }
+    print(json.dumps(result))
+
+    if unwanted or (args.max_ms is not None and
+                    result["median_ms"] > args.max_ms):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Benchmark suite running against the local eLicznik stand-in.
+
+Measures end-to-end fetch time, parse throughput, cache I/O and table
+rendering for growing history and number of meters. Every result is
+printed as a single JSON line, so results can be compared between runs.
+
+    python3 benchmarks/suite.py [--years 1 5 20] [--meters 1 50]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import contextlib
+
+from io import StringIO
+from time import perf_counter
+from datetime import date
+from typing import Any, Callable, TextIO
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from fake_elicznik import FakeELicznik  # noqa: E402
+from data_processor import (  # noqa: E402
+    DataTypes, DataPoint, MonthlyData, load_cache, save_cache)
+from table_view import TableView, Cell, CellAlignment  # noqa: E402
+
+
+def timed(func: Callable[[], Any], repeat: int = 1) -> tuple[float, Any]:
+    """Best wall time (in seconds) of the function and its last result"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        best = min(best, perf_counter() - start)
+    return best, result
+
+
+def start_date(years: int, today: date) -> date:
+    return date(today.year - years, today.month, 1)
+
+
+def bench_fetch(fake: FakeELicznik, years: int, meters: int, workers: int,
+                coalesce: bool, today: date) -> dict[str, Any]:
+    from tauron import login_to_tauron, gather_and_parse_data_from_tauron
+
+    first_day = start_date(years, today)
+
+    def fetch() -> int:
+        months = 0
+        for meter_id in range(meters):
+            session = login_to_tauron("user", "password", [], False)
+            months += len(gather_and_parse_data_from_tauron(
+                session, str(meter_id), first_day, today, first_day,
+                True, workers, coalesce))
+        return months
+
+    requests_before = fake.requests
+    with contextlib.redirect_stderr(StringIO()):
+        seconds, months = timed(fetch)
+
+    return {
+        "seconds": round(seconds, 4),
+        "months": months,
+        "requests": fake.requests - requests_before,
+        "workers": workers,
+        "coalesce": coalesce,
+    }
+
+
+def synthetic_monthly_data(fake: FakeELicznik, years: int, today: date
+                           ) -> list[tuple[date, dict[DataTypes, Any]]]:
+    """Raw API payloads (as returned by the stand-in) for each month"""
+    from month import last_day_of_month, month_ordinal, month_of_ordinal
+
+    payloads = []
+    month = start_date(years, today)
+    while month < today:
+        payloads.append((month, {eng_type: fake.data({
+            "from": month.strftime("%d.%m.%Y"),
+            "to": last_day_of_month(month).strftime("%d.%m.%Y"),
+            "type": str(eng_type),
+            "profile": "month"})["data"] for eng_type in DataTypes}))
+        month = month_of_ordinal(month_ordinal(month) + 1)
+    return payloads
+
+
+def bench_parse(payloads: list[tuple[date, dict[DataTypes, Any]]],
+                meters: int) -> dict[str, Any]:
+    def parse() -> list[DataPoint]:
+        consume, oze = [], []
+        for _ in range(meters):
+            for month, data in payloads:
+                consume.append(MonthlyData.parseData(
+                    DataTypes.consume, month, data[DataTypes.consume]))
+                oze.append(MonthlyData.parseData(
+                    DataTypes.oze, month, data[DataTypes.oze]))
+        return DataPoint.fromMonthlyBatch(consume, oze)
+
+    seconds, data_points = timed(parse, repeat=3)
+    return {
+        "seconds": round(seconds, 4),
+        "months": len(data_points),
+        "months_per_second": round(len(data_points) / seconds),
+    }
+
+
+def bench_cache(data_points: list[DataPoint], meters: int
+                ) -> dict[str, Any]:
+    """Save and load cache of every meter (one file per meter).
+
+    Each save starts in a new directory, otherwise only the first one
+    would write anything (unchanged rows are not saved again).
+    """
+    months = len(data_points) // meters
+    per_meter = [data_points[idx * months:(idx + 1) * months]
+                 for idx in range(meters)]
+    paths = [f"cache_{meter_id}.csv" for meter_id in range(meters)]
+
+    with tempfile.TemporaryDirectory() as workdir, \
+            contextlib.chdir(workdir), \
+            contextlib.redirect_stderr(StringIO()):
+        runs = 0
+
+        def save() -> None:
+            nonlocal runs
+            runs += 1
+            os.mkdir(str(runs))
+            for path, data in zip(paths, per_meter):
+                save_cache(data, os.path.join(str(runs), path))
+
+        def load() -> int:
+            return sum(len(load_cache(os.path.join(str(runs), path)))
+                       for path in paths)
+
+        save_seconds, _ = timed(save, repeat=3)
+        load_seconds, loaded = timed(load, repeat=3)
+
+    return {
+        "save_seconds": round(save_seconds, 4),
+        "load_seconds": round(load_seconds, 4),
+        "months": loaded,
+    }
+
+
+def bench_render(data_points: list[DataPoint]) -> dict[str, Any]:
+    def render() -> int:
+        table = TableView()
+        table.set_header([
+            ("date", "Date"), ("usage", "Usage"), ("renewable_energy", "RE"),
+            ("days_with_positive_balance", "(+) days"),
+            ("monthly_balance", "Balance")])
+        for dp in data_points:
+            table.add_row([
+                f"{dp.month:%Y-%m}", f"{dp.usage:.2f}", f"{dp.oze:.2f}",
+                dp.positive_days,
+                Cell(dp.balance, "balance", CellAlignment.RIGHT)])
+        return len(str(table))
+
+    seconds, _ = timed(render, repeat=3)
+    return {"seconds": round(seconds, 4), "rows": len(data_points)}
+
+
+def report(output: TextIO, name: str, params: dict[str, Any],
+           result: dict[str, Any]) -> None:
+    output.write(json.dumps({"benchmark": name, **params, **result}) + "\n")
+    output.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--meters', type=int, nargs='+', default=[1, 50])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--skip-fetch', action='store_true',
+                        help="Don't run (slow) end-to-end fetch benchmarks.")
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        default=sys.stdout)
+    args = parser.parse_args()
+
+    today = date.today()
+    fake = FakeELicznik(latency_ms=args.latency_ms,
+                        error_rate=args.error_rate, today=today).start()
+    fake.patch_tauron()
+
+    try:
+        for years in args.years:
+            payloads = synthetic_monthly_data(fake, years, today)
+            for meters in args.meters:
+                params = {"years": years, "meters": meters}
+
+                if not args.skip_fetch:
+                    for workers in args.workers:
+                        for coalesce in (False, True):
+                            try:
+                                result = bench_fetch(
+                                    fake, years, meters, workers, coalesce,
+                                    today)
+                            except SystemExit:
+                                # NOTE: errors are fatal for fetching code
+                                result = {"failed": True, "workers": workers,
+                                          "coalesce": coalesce}
+                            report(args.output, "fetch", params, result)
+
+                report(args.output, "parse", params,
+                       bench_parse(payloads, meters))
+
+                data_points = DataPoint.fromMonthlyBatch(*(
+                    [MonthlyData.parseData(eng_type, month, data[eng_type])
+                     for month, data in payloads] * meters
+                    for eng_type in DataTypes))
+                report(args.output, "cache", params,
+                       bench_cache(data_points, meters))
+                report(args.output, "render", params,
+                       bench_render(data_points))
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import os
+import json
+import stat
+import argparse
+import threading
+import socketserver
+
+from datetime import date, datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from typing import Any
+
+from batch import (
+    MeterConfig, SessionPool, check_options, parse_meters, fetch_options,
+    configure_fetching, update_meter)
+from data_processor import MonthSeries, CACHE_FILE_PATH
+from ledger import Ledger, CREDIT_VALIDITY
+from report import fill_table
+from table_view import TableView
+from util import print_wrn, print_err, print_note
+
+REFRESH_INTERVAL = 60  # minutes
+
+
+class ReportState():
+    """DataPoints of all meters kept in memory with rendered responses.
+
+    Responses are rendered once after every refresh, so serving them
+    doesn't require any processing.
+    """
+    def __init__(self, meters: list[MeterConfig], config: dict[str, Any],
+                 args: argparse.Namespace) -> None:
+        self.meters = meters
+        self.config = config
+        self.args = args
+        self.options = fetch_options(config)
+        self.pool: SessionPool | None = None
+        self.data: dict[str, MonthSeries] = {}
+        # Settled incrementally (only changed months) after every refresh
+        self.ledgers: dict[str, Ledger] = {}
+        # path -> (content type, body)
+        self.responses: dict[str, tuple[str, bytes]] = {}
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Download missing days of all meters and render responses"""
+        with self._refresh_lock:
+            if not self.args.offline and self.pool is None:
+                self.pool = configure_fetching(self.config, self.options)
+
+            accounts = [meter.username for meter in self.meters]
+            date_today = date.today()
+            for meter in self.meters:
+                try:
+                    self.data[meter.meter_id] = update_meter(
+                        meter, self.pool,
+                        accounts.count(meter.username) > 1, self.args,
+                        self.options, date_today,
+                        self.data.get(meter.meter_id))
+                except (SystemExit, Exception) as e:
+                    # NOTE: errors are fatal in other modes, but
+                    # daemon should keep serving data that it already has
+                    # (e.g. network errors while logging in)
+                    reason = "" if isinstance(e, SystemExit) else f": {e}"
+                    print_wrn(f"Unable to refresh data for {meter.name}"
+                              f"{reason}.")
+
+            self.render(date_today)
+
+    def render(self, date_today: date) -> None:
+        price_kWh = self.config.get("price", None)
+        monthly_fixed_cost = self.config.get("fixed_cost", None)
+
+        validity = int(self.config.get("credit_validity", CREDIT_VALIDITY))
+
+        tables, rows, summaries = [], {}, {}
+        for meter in self.meters:
+            data = self.data.get(meter.meter_id, MonthSeries())
+            table = TableView()
+            summary = fill_table(
+                table, data, meter.installation_date, date_today)
+            if summary.months:
+                # Same net-metering settlement as in single meter mode
+                ledger = self.ledgers.setdefault(
+                    meter.meter_id, Ledger(validity=validity))
+                ledger.update(data)
+                summary.to_pay, summary.banked = ledger.settlement(
+                    data[0].month, data[-1].month)
+            tables.append(f"# {meter.name}\n{table}")
+            rows[meter.name] = json.loads(table.to_json())
+            summaries[meter.name] = summary.as_dict(
+                price_kWh, monthly_fixed_cost)
+
+        updated_at = datetime.now().isoformat(timespec="seconds")
+        # NOTE: whole dict is replaced at once, so readers never see
+        # partially rendered responses
+        self.responses = {
+            "/table": ("text/plain; charset=utf-8",
+                       "\n".join(tables).encode()),
+            "/json": ("application/json", json.dumps(
+                {"updated_at": updated_at, "meters": rows}).encode()),
+            "/summary": ("application/json", json.dumps(
+                {"updated_at": updated_at, "meters": summaries}).encode()),
+        }
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    state: ReportState
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        response = self.state.responses.get(self.path.split("?")[0])
+        if response is None:
+            self.send_error(404)
+            return
+
+        content_type, body = response
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self) -> tuple[Any, Any]:
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects (host, port) client address
+        return request, ("local", 0)
+
+
+def create_server(address: str, handler: type[BaseHTTPRequestHandler]
+                  ) -> socketserver.BaseServer:
+    """HTTP server listening on "host:port" or on Unix socket (path)"""
+    if ":" in address and "/" not in address:
+        host, port = address.rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), handler)
+        server.daemon_threads = True
+        return server
+
+    if os.path.lexists(address):
+        # NOTE: Only socket left by the previous run is removed
+        if not stat.S_ISSOCK(os.lstat(address).st_mode):
+            print_err(f"{address} exists and it's not a socket.")
+        os.remove(address)
+    return UnixHTTPServer(address, handler)
+
+
+def refresh_loop(state: ReportState, interval: float,
+                 stop: threading.Event) -> None:
+    while not stop.wait(interval):
+        print_note("Refreshing data...")
+        try:
+            state.refresh()
+        except Exception as e:
+            # Loop has to survive, the next refresh might succeed
+            print_wrn(f"Refresh failed: {e}")
+
+
+def run_daemon(config: dict[str, Any], args: argparse.Namespace) -> None:
+    """Serve table, json and summary, refresh data in the background"""
+    check_options(args, "daemon")
+    if "meters" in config:
+        meters = parse_meters(config)
+    else:
+        meters = [MeterConfig(
+            meter_id=str(config["meter_id"]),
+            username=config["username"],
+            password=config["password"],
+            installation_date=date.fromisoformat(config["installation_date"]),
+            name=str(config["meter_id"]),
+            cache_file=CACHE_FILE_PATH)]
+
+    state = ReportState(meters, config, args)
+    print_note("Loading data...")
+    state.refresh()
+
+    handler = type("Handler", (ReportHandler,), {"state": state})
+    server = create_server(args.serve, handler)
+
+    stop = threading.Event()
+    interval = float(config.get("refresh_interval", REFRESH_INTERVAL)) * 60
+    threading.Thread(
+        target=refresh_loop, args=(state, interval, stop), daemon=True
+    ).start()
+
+    print_note(f"Serving /table, /json and /summary on {args.serve}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        if (isinstance(server, UnixHTTPServer) and
+                os.path.exists(server.server_address)):
+            os.remove(server.server_address)
@@ -0,0 +1,113 @@
+import sqlite3
+
+from datetime import date, datetime, timedelta
+
+from data_processor import (
+    DataTypes, MonthlyData, DataPoint, aggregate_months)
+from util import print_note
+
+DAILY_STORE_FILE_PATH = "daily.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_values (
+    meter_id TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    day TEXT NOT NULL,
+    value REAL NOT NULL,
+    tariff TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (meter_id, data_type, day)
+) WITHOUT ROWID;
+"""
+
+
+def open_store(path: str = DAILY_STORE_FILE_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def save_monthly_data(conn: sqlite3.Connection, meter_id: str,
+                      monthly_data: list[MonthlyData]) -> None:
+    """Save (or replace) daily values of provided months."""
+    fetched_at = datetime.now().isoformat(timespec="seconds")
+    rows = []
+    for md in monthly_data:
+        first_day = md.month.replace(day=md.first_day)
+        for idx, value in enumerate(md.values):
+            if value is None:
+                continue
+            rows.append((
+                meter_id, str(md.data_type),
+                (first_day + timedelta(days=idx)).isoformat(),
+                value, md.tariff, fetched_at))
+
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO daily_values VALUES (?, ?, ?, ?, ?, ?)",
+            rows)
+
+
+def load_monthly_data(
+        conn: sqlite3.Connection, meter_id: str,
+        data_type: DataTypes) -> dict[date, MonthlyData]:
+    """Load all stored daily values of selected type grouped by month
+    (first day of the month is used as a key)."""
+    monthly_data: dict[date, MonthlyData] = {}
+    rows = conn.execute(
+        "SELECT day, value, tariff FROM daily_values "
+        "WHERE meter_id = ? AND data_type = ? ORDER BY day",
+        (meter_id, str(data_type)))
+
+    for day_str, value, tariff in rows:
+        day = date.fromisoformat(day_str)
+        month = day.replace(day=1)
+        if month not in monthly_data:
+            # NOTE: same as for API, month might start with the first day
+            # with available data (e.g. installation date)
+            monthly_data[month] = MonthlyData(
+                day, [], 0.0, tariff, data_type)
+        md = monthly_data[month]
+        # NOTE: Missing days are treated as days without any energy flow
+        md.values.extend([0.0] * (day.day - md.month.day - len(md.values)))
+        md.values.append(value)
+        md.eng_sum += value
+        md.tariff = tariff
+
+    return monthly_data
+
+
+def load_days(conn: sqlite3.Connection, meter_id: str,
+              data_type: DataTypes) -> dict[int, float]:
+    """Stored values of selected type by day ordinal (missing days
+    are not included)."""
+    rows = conn.execute(
+        "SELECT day, value FROM daily_values "
+        "WHERE meter_id = ? AND data_type = ?",
+        (meter_id, str(data_type)))
+    return {date.fromisoformat(day_str).toordinal(): value
+            for day_str, value in rows}
+
+
+def load_fetch_days(conn: sqlite3.Connection, meter_id: str,
+                    data_type: DataTypes) -> dict[int, int]:
+    """Day (ordinal) when each stored value was downloaded, by day"""
+    rows = conn.execute(
+        "SELECT day, fetched_at FROM daily_values "
+        "WHERE meter_id = ? AND data_type = ?",
+        (meter_id, str(data_type)))
+    return {date.fromisoformat(day_str).toordinal():
+            date.fromisoformat(fetched_at[:10]).toordinal()
+            for day_str, fetched_at in rows}
+
+
+def rebuild_datapoints(conn: sqlite3.Connection, meter_id: str,
+                       installation_date: date) -> list[DataPoint]:
+    """Aggregate stored daily values into DataPoints (no network needed)."""
+    consume = load_monthly_data(conn, meter_id, DataTypes.consume)
+    oze = load_monthly_data(conn, meter_id, DataTypes.oze)
+
+    data = aggregate_months(consume, oze, installation_date)
+
+    print_note(f"{len(data)} months rebuilt from daily store.")
+    return data
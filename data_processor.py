@@ -1,15 +1,35 @@
+import os
 import csv
+import operator
 
+from io import StringIO
+from array import array
+from bisect import bisect_left, bisect_right
 from enum import StrEnum
 from datetime import date
+from itertools import repeat
+from contextlib import contextmanager
 from dataclasses import dataclass
 
-from typing import Any
+from typing import Any, Iterable, Iterator, overload
 
-from month import last_day_of_month
-from util import print_wrn, print_note
+from month import (
+    month_key, month_length, month_lengths, month_ordinal, month_start,
+    year_ordinals)
+from util import print_wrn, print_note, Numeric
 
 RE_RETRIEVE_RATIO = 0.8  # 80% of cumulated energy sent to the grid
+CACHE_FILE_PATH = "cache.csv"
+CACHE_LOCK_SUFFIX = ".lock"
+# Cache is compacted when it has that many rows per month (see save_cache)
+CACHE_COMPACTION_RATIO = 2
+# Last days of a month might be published after the next one started,
+# so that many last months are continued (older gaps are left to --repair)
+DELAYED_MONTHS = 2
+
+# Batch aggregation (every month is padded to the same length)
+MAX_DAYS = 31
+ZEROS = [0.0] * MAX_DAYS
 
 
 class DataTypes(StrEnum):
@@ -41,7 +61,7 @@ def rfilter_nones(_list: list[Any | None]) -> list[Any]:
     return _list[:-idx] if idx is not None else []
 
 
-@dataclass
+@dataclass(slots=True)
 class MonthlyData:
     """This dataclass represents data points from Tauron API.
 
@@ -58,6 +78,16 @@ class MonthlyData:
     tariff: str
     data_type: DataTypes
 
+    @property
+    def first_day(self) -> int:
+        """Day of the month represented by the first value"""
+        # NOTE: API returns whole month (with leading Nones) for some ranges,
+        # then there are more values than days since self.month
+        length = month_length(month_ordinal(self.month))
+        if len(self.values) > length - self.month.day + 1:
+            return 1
+        return self.month.day
+
     @classmethod
     def parseData(cls, data_type: DataTypes,
                   date: date, data: dict[str, Any]) -> 'MonthlyData':
@@ -67,17 +97,66 @@ class MonthlyData:
 
         # Filter out Nones
         values: list[float] = rfilter_nones(data["values"])
+        eng_sum = data["sum"]
+
+        # NOTE: API returns whole month (with leading Nones) for some ranges
+        # starting in the middle of the month, days before are dropped.
+        # Trailing Nones are already removed, so such response might be
+        # shorter than the requested range, but it starts with Nones.
+        skip = date.day - 1
+        if skip and len(values) > skip and (
+                len(values) > month_length(month_ordinal(date)) - skip or
+                all(value is None for value in values[:skip])):
+            values = values[skip:]
+            eng_sum = sum(value for value in values if value is not None)
 
         return cls(
             month=date,
             values=values,
-            eng_sum=data["sum"],
+            eng_sum=eng_sum,
             tariff=data["tariff"],
             data_type=data_type
         )
 
+    @classmethod
+    def parseRangeData(cls, data_type: DataTypes, months: list[date],
+                       data: dict[str, Any]) -> list['MonthlyData']:
+        """Split data for a range of whole months into MonthlyData objects.
 
-@dataclass
+        Only daily values can be split, so the number of values has to match
+        the number of days in all provided months.
+        """
+        if not all(key in data for key in ("values", "tariff")):
+            raise ValueError("Provided data are in unsupported shape")
+
+        lengths = month_lengths(months)
+        if len(data["values"]) != sum(lengths):
+            raise ValueError(
+                f"Expected {sum(lengths)} daily values, "
+                f"{len(data['values'])} found instead")
+
+        monthly_data: list[MonthlyData] = []
+        offset = 0
+        for month, length in zip(months, lengths):
+            values: list[float] = rfilter_nones(
+                data["values"][offset:offset + length])
+            offset += length
+            if not values:
+                # No data for this month (and the following ones)
+                break
+
+            monthly_data.append(cls(
+                month=month,
+                values=values,
+                eng_sum=sum(v for v in values if v is not None),
+                tariff=data["tariff"],
+                data_type=data_type
+            ))
+
+        return monthly_data
+
+
+@dataclass(slots=True)
 class DataPoint:
     """This dataclass represents data points that are shown
     in the summary table, as well as saved in cache.
@@ -98,6 +177,30 @@ class DataPoint:
     days: int  # TODO: consider renaming to last_day
     positive_days: int
 
+    @property
+    def last_day(self) -> int:
+        """Last day of the month with available data (watermark)"""
+        # NOTE: month might start in the middle (e.g. installation date)
+        return min(self.month.day - 1 + self.days,
+                   month_length(month_ordinal(self.month)))
+
+    @property
+    def is_complete(self) -> bool:
+        return self.last_day == month_length(month_ordinal(self.month))
+
+    def merge(self, newer: 'DataPoint') -> 'DataPoint':
+        """Extend this (partial) month with data gathered after watermark"""
+        if month_ordinal(self.month) != month_ordinal(newer.month):
+            raise ValueError("Provided data are for different month.")
+
+        return DataPoint(
+            self.month,
+            self.usage + newer.usage,
+            self.oze + newer.oze,
+            self.balance + newer.balance,
+            self.days + newer.days,
+            self.positive_days + newer.positive_days)
+
     def __iter__(self):
         """To be used by CSV writer"""
         return iter([
@@ -127,29 +230,30 @@ class DataPoint:
 
         processed_month = consume_data.month
         last_day = len(consume_data.values)
+        consume_values = consume_data.values
+        oze_values = oze_data.values
 
         # NOTE: Sometimes we want to exclude some data, for example when
         # installation date was in the middle of the month
         if (start_date is not None and
-                start_date.year == processed_month.year and
-                start_date.month == processed_month.month):
+                month_ordinal(start_date) == month_ordinal(processed_month)):
             # NOTE: This step might not be needed - after switching  to OZE
             # API return None values for day before OZE
-            if last_day_of_month(start_date).day == len(consume_data.values):
+            if month_length(month_ordinal(start_date)) == len(consume_values):
                 print_note("Trimming data...")
                 day = start_date.day - 1  # Tables indexes start from 0
-                consume_data.values = consume_data.values[day:]
-                oze_data.values = oze_data.values[day:]
+                consume_values = consume_values[day:]
+                oze_values = oze_values[day:]
                 # NOTE: We don't need to modify last day
 
         # NOTE: if start data is None, we could use precalculated sum (eng_sum)
-        usage = sum(consume_data.values)
-        oze_sum = sum(oze_data.values)
+        usage = sum(consume_values)
+        oze_sum = sum(oze_values)
         balance = oze_sum * RE_RETRIEVE_RATIO - usage
 
         positive_days = sum(
             (o * RE_RETRIEVE_RATIO - c) > 0
-            for c, o in zip(consume_data.values, oze_data.values))
+            for c, o in zip(consume_values, oze_values))
 
         return cls(
             processed_month,
@@ -159,51 +263,410 @@ class DataPoint:
             last_day,
             positive_days)
 
+    @classmethod
+    def fromMonthlyBatch(cls, consume_data: list[MonthlyData],
+                         oze_data: list[MonthlyData],
+                         start_date: date | None = None) -> list['DataPoint']:
+        """Initialize DataPoints for many months at once.
+
+        Values of all months are packed into flat lists (padded with zeros
+        to MAX_DAYS per month) and aggregated in a single pass. Data points
+        before start_date are masked out (set to zero) in packed lists.
 
-def load_cache() -> list[DataPoint]:
-    data = []
+        Args:
+            consume_data (list[MonthlyData]): 'consume' data of each month
+            oze_data (list[MonthlyData]): 'oze' data for the same months
+            start_date (date): If defined, ignores data points before that date
+        """
+        if len(consume_data) != len(oze_data):
+            raise ValueError("Provided data are for different months.")
+
+        start_month = None if start_date is None else month_ordinal(start_date)
+        consume_values: list[float] = []
+        oze_values: list[float] = []
+        # Positive days after the last 'consume' value (not taken into account)
+        unpaired: dict[int, int] = {}
+
+        for idx, (cd, od) in enumerate(zip(consume_data, oze_data)):
+            if (cd.data_type != DataTypes.consume or
+                    od.data_type != DataTypes.oze):
+                raise ValueError("Provided data in a wrong type.")
+
+            if cd.month != od.month:
+                raise ValueError("Provided data are for different month.")
+
+            offset = idx * MAX_DAYS
+            consume_values += cd.values
+            consume_values += ZEROS[len(cd.values):]
+            oze_values += od.values
+            oze_values += ZEROS[len(od.values):]
+
+            # NOTE: Same trimming as in fromMonthlyData
+            if (start_date is not None and
+                    start_month == month_ordinal(cd.month) and
+                    month_length(start_month) == len(cd.values)):
+                print_note("Trimming data...")
+                day = start_date.day - 1  # Tables indexes start from 0
+                consume_values[offset:offset + day] = ZEROS[:day]
+                oze_values[offset:offset + day] = ZEROS[:day]
+
+            if len(od.values) > len(cd.values):
+                unpaired[idx] = sum(
+                    o * RE_RETRIEVE_RATIO > 0 for o in oze_values[
+                        offset + len(cd.values):offset + len(od.values)])
+
+        def monthly_sums(values: Iterable[Numeric]) -> list[Numeric]:
+            return list(map(sum, zip(*[iter(values)] * MAX_DAYS)))
+
+        usage = monthly_sums(consume_values)
+        oze_sum = monthly_sums(oze_values)
+        positive_days = monthly_sums(map(
+            operator.gt,
+            map(operator.mul, oze_values, repeat(RE_RETRIEVE_RATIO)),
+            consume_values))
+
+        return [cls(
+            cd.month,
+            u,
+            o,
+            o * RE_RETRIEVE_RATIO - u,
+            len(cd.values),
+            p - unpaired.get(idx, 0)) for idx, (cd, u, o, p) in enumerate(zip(
+                consume_data, usage, oze_sum, positive_days))]
+
+
+class MonthSeries():
+    """Sorted monthly data points kept column by column in typed arrays.
+
+    Months are indexed by their ordinal (see month.month_ordinal), so
+    slicing by dates, merging and sorting operate on plain integers.
+    DataPoints are created only on access (iteration, indexing).
+    """
+    __slots__ = ("ordinals", "first_days", "usage", "oze", "balance",
+                 "days", "positive_days")
+
+    COLUMNS = __slots__
+    TYPECODES = ('l', 'b', 'd', 'd', 'd', 'h', 'h')
+
+    def __init__(self, data: Iterable[DataPoint] = ()) -> None:
+        for column, typecode in zip(self.COLUMNS, self.TYPECODES):
+            setattr(self, column, array(typecode))
+        self.extend(data)
+
+    def _columns(self) -> Iterator[array]:
+        return (getattr(self, column) for column in self.COLUMNS)
+
+    def append(self, dp: DataPoint) -> None:
+        self.ordinals.append(month_ordinal(dp.month))
+        self.first_days.append(dp.month.day)
+        self.usage.append(dp.usage)
+        self.oze.append(dp.oze)
+        self.balance.append(dp.balance)
+        self.days.append(dp.days)
+        self.positive_days.append(dp.positive_days)
+
+    def extend(self, data: Iterable[DataPoint]) -> None:
+        if isinstance(data, MonthSeries):
+            for column, other in zip(self._columns(), data._columns()):
+                column.extend(other)
+            return
+        for dp in data:
+            self.append(dp)
+
+    def month(self, idx: int) -> date:
+        year, month = divmod(self.ordinals[idx], 12)
+        return date(year, month + 1, self.first_days[idx])
+
+    def __len__(self) -> int:
+        return len(self.ordinals)
+
+    def __iter__(self) -> Iterator[DataPoint]:
+        for ordinal, first_day, usage, oze, balance, days, positive_days in zip(
+                *self._columns()):
+            year, month = divmod(ordinal, 12)
+            yield DataPoint(date(year, month + 1, first_day), usage, oze,
+                            balance, days, positive_days)
+
+    @overload
+    def __getitem__(self, idx: int) -> DataPoint: ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> 'MonthSeries': ...
+
+    def __getitem__(self, idx: int | slice) -> 'DataPoint | MonthSeries':
+        if isinstance(idx, slice):
+            series = MonthSeries()
+            for column in self.COLUMNS:
+                setattr(series, column, getattr(self, column)[idx])
+            return series
+
+        return DataPoint(self.month(idx), self.usage[idx], self.oze[idx],
+                         self.balance[idx], self.days[idx],
+                         self.positive_days[idx])
+
+    def __setitem__(self, idx: int, dp: DataPoint) -> None:
+        self.ordinals[idx] = month_ordinal(dp.month)
+        self.first_days[idx] = dp.month.day
+        self.usage[idx] = dp.usage
+        self.oze[idx] = dp.oze
+        self.balance[idx] = dp.balance
+        self.days[idx] = dp.days
+        self.positive_days[idx] = dp.positive_days
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, MonthSeries):
+            return NotImplemented
+        return all(a == b for a, b in zip(self._columns(), other._columns()))
+
+    def bounds(self, first_day: date | None,
+               last_day: date | None) -> tuple[int, int]:
+        """Indexes of the first and after the last month in the range"""
+        return self.ordinal_bounds(
+            None if first_day is None else month_ordinal(first_day),
+            None if last_day is None else month_ordinal(last_day))
+
+    def ordinal_bounds(self, first: int | None,
+                       last: int | None) -> tuple[int, int]:
+        """Same as bounds, but for month ordinals"""
+        start = 0 if first is None else bisect_left(self.ordinals, first)
+        stop = len(self) if last is None else bisect_right(self.ordinals, last)
+        return start, stop
+
+    def year(self, year: int) -> 'MonthSeries':
+        """Months of the selected year only"""
+        start, stop = self.ordinal_bounds(*year_ordinals(year))
+        return self[start:stop]
+
+    def _take(self, order: Iterable[int]) -> 'MonthSeries':
+        order = list(order)
+        series = MonthSeries()
+        for column, typecode in zip(self.COLUMNS, self.TYPECODES):
+            setattr(series, column, array(
+                typecode, map(getattr(self, column).__getitem__, order)))
+        return series
+
+    def sort(self) -> None:
+        """Sort months in place (nothing is done if already sorted)"""
+        ordinals = self.ordinals
+        if all(map(operator.le, ordinals, ordinals[1:])):
+            return
+        order = sorted(range(len(ordinals)), key=ordinals.__getitem__)
+        for column in self.COLUMNS:
+            setattr(self, column, getattr(self._take(order), column))
+
+    def merge(self, newer: 'MonthSeries') -> 'MonthSeries':
+        """Both series combined, months from newer replace the same ones"""
+        replaced = set(newer.ordinals)
+        series = self._take(idx for idx, ordinal in enumerate(self.ordinals)
+                            if ordinal not in replaced)
+        series.extend(newer)
+        series.sort()
+        return series
+
+
+def known_days(consume: MonthlyData, oze: MonthlyData
+               ) -> tuple[MonthlyData, MonthlyData]:
+    """Both types cut before the first day that is missing in any of them.
+
+    NOTE: Missing days are not zeros, so the month stays incomplete
+    (and the rest is downloaded later).
+    """
+    if None not in consume.values and None not in oze.values:
+        return consume, oze
+
+    known = min(
+        next((idx for idx, value in enumerate(md.values) if value is None),
+             len(md.values))
+        for md in (consume, oze))
+    consume, oze = (MonthlyData(
+        md.month, md.values[:known], sum(md.values[:known]), md.tariff,
+        md.data_type) for md in (consume, oze))
+    return consume, oze
+
+
+def aggregate_months(consume: dict[date, MonthlyData],
+                     oze: dict[date, MonthlyData],
+                     installation_date: date) -> list[DataPoint]:
+    """Aggregate daily values grouped by month (first day of the month is
+    a key, MonthlyData starts with the first day with data) into the same
+    DataPoints as data gathered from the API."""
+    months = [month for month in sorted(consume.keys() & oze.keys())
+              if month >= installation_date.replace(day=1)]
+    for month in months[:1]:
+        if month == installation_date.replace(day=1):
+            # Keep the same month as data gathered from the API
+            consume[month].month = max(consume[month].month, installation_date)
+            oze[month].month = max(oze[month].month, installation_date)
+
+    return DataPoint.fromMonthlyBatch(
+        [consume[month] for month in months],
+        [oze[month] for month in months],
+        installation_date)
+
+
+@contextmanager
+def cache_lock(path: str) -> Iterator[None]:
+    """Exclusive lock for cache writers (readers never wait for it).
+
+    NOTE: Lock is taken on a separate file, because the cache file itself
+    is replaced during compaction.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # Not available on Windows, concurrent writers are not supported
+        yield
+        return
+
+    with open(f"{path}{CACHE_LOCK_SUFFIX}", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_cache_rows(path: str) -> tuple[dict[int, list[str]], int]:
+    """Rows of the cache file (the last one of each month) and
+    the number of all rows in the file."""
+    with open(path, newline='') as csv_file:
+        content = csv_file.read()
+
+    lines = content.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        # Row that is being appended by other process right now
+        lines.pop()
+
+    rows: dict[int, list[str]] = {}
+    for row in csv.reader(lines, delimiter=';', quotechar='|'):
+        if not row:
+            continue
+        try:
+            # NOTE: Updates are appended, so the last row of a month wins
+            rows[month_key(row[0])] = row
+        except (ValueError, IndexError):
+            # Broken month is kept under its own (negative) key,
+            # so it's reported by load_cache
+            rows[-len(rows) - 1] = row
+    return rows, len(lines)
+
+
+def load_cache(path: str = CACHE_FILE_PATH) -> MonthSeries:
+    data = MonthSeries()
     try:
-        with open('cache.csv') as csv_file:
-            reader = csv.reader(csv_file, delimiter=';', quotechar='|')
-            for row in reader:
-                if len(row) != 6:
-                    raise ValueError(
-                        f"each row supposed to have 6 elements, "
-                        f"{len(row)} found instead.")
-
-                data.append(DataPoint(
-                    date.fromisoformat(row[0]),
-                    float(row[1]),
-                    float(row[2]),
-                    float(row[3]),
-                    int(row[4]),
-                    int(row[5]),
-                ))
+        rows, _ = read_cache_rows(path)
     except IOError:
         print_wrn("Cache file is not accessible.")
-    except ValueError as e:
-        print_wrn(f"Cache file is corrupted: {e}")
-        return []
-
+        return data
+
+    for row in rows.values():
+        try:
+            if len(row) != 6:
+                raise ValueError(
+                    f"each row supposed to have 6 elements, "
+                    f"{len(row)} found instead.")
+
+            data.append(DataPoint(
+                date.fromisoformat(row[0]),
+                float(row[1]),
+                float(row[2]),
+                float(row[3]),
+                int(row[4]),
+                int(row[5]),
+            ))
+        except ValueError as e:
+            # NOTE: Only broken row is skipped (its month is downloaded again)
+            print_wrn(f"Cache file is corrupted: {e}")
+
+    data.sort()
     return data
 
 
-def save_cache(
-        data: list[DataPoint], last_datapoint_date: date) -> None:
+def save_cache(data: Iterable[DataPoint], path: str = CACHE_FILE_PATH,
+               quiet: bool = False) -> None:
+    """Append changed months to the cache (shared by many processes).
 
-    data_to_save = data
+    Writers hold the cache lock, rows are appended (the last row of a month
+    wins), so readers never see partially written file. When most of rows
+    are outdated, the file is compacted (written again and replaced).
+    """
+    # NOTE: Current (partial) month is saved as well, number of days
+    # is used as a watermark, so next run downloads only missing days
+    if not quiet:
+        print_note("Saving cache...")
+
+    with cache_lock(path):
+        try:
+            on_disk, rows_count = read_cache_rows(path)
+        except FileNotFoundError:
+            on_disk, rows_count = {}, 0
+
+        new_rows = []
+        for dp in data:
+            row = [str(value) for value in dp]
+            key = month_ordinal(dp.month)
+            old_row = on_disk.get(key)
+            # Row saved by other process might cover more days
+            if old_row == row or (
+                    old_row is not None and len(old_row) == 6 and
+                    old_row[4].isdigit() and int(old_row[4]) > dp.days):
+                continue
+            on_disk[key] = row
+            new_rows.append(row)
+
+        if not new_rows:
+            return
+
+        buffer = StringIO()
+        writer = csv.writer(
+            buffer, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        if rows_count + len(new_rows) <= CACHE_COMPACTION_RATIO * len(on_disk):
+            writer.writerows(new_rows)
+            with open(path, 'a', newline='') as csv_file:
+                csv_file.write(buffer.getvalue())
+            return
+
+        # NOTE: File is replaced at once, so readers see old or new content
+        writer.writerows(on_disk[month] for month in sorted(on_disk))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', newline='') as csv_file:
+            csv_file.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+
+def first_missing_day(data: MonthSeries, default: date) -> date:
+    """Day after the last one with data (default if there are no data).
+
+    The earliest incomplete month of the last DELAYED_MONTHS is continued,
+    so days published late are downloaded by the next run.
+    """
+    if not data:
+        return default
+    idx = next((idx for idx in range(max(len(data) - DELAYED_MONTHS, 0),
+                                     len(data) - 1)
+                if not data[idx].is_complete), len(data) - 1)
+    return date.fromordinal(
+        month_start(data.ordinals[idx]) + data[idx].last_day)
 
-    # Skip current month since data might be incomplete
-    if (data_to_save[-1].month.year == last_datapoint_date.year and
-            data_to_save[-1].month.month == last_datapoint_date.month):
-        print_note(
-            f"Skipping {last_datapoint_date.year}-{last_datapoint_date.month} "
-            f"from saving in cache.")
-        data_to_save = data[:-1]
 
-    print_note("Saving cache...")
-    with open('cache.csv', 'w') as csv_file:
-        cache = csv.writer(
-            csv_file, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+def extend_data(data: MonthSeries, new_data: list[DataPoint]) -> None:
+    """Add newly gathered data points.
 
-        cache.writerows(data_to_save)
+    Month that is already in data is extended (if new data point starts
+    after its watermark) or replaced (if it covers all its days).
+    """
+    for dp in new_data:
+        ordinal = month_ordinal(dp.month)
+        start, stop = data.ordinal_bounds(ordinal, ordinal)
+        if start == stop:
+            data.append(dp)
+            continue
+
+        cached = data[start]
+        if dp.month.day == cached.last_day + 1:
+            data[start] = cached.merge(dp)
+        elif (dp.month.day <= cached.month.day and
+                dp.last_day >= cached.last_day):
+            data[start] = dp
+
+    data.sort()
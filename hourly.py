@@ -0,0 +1,137 @@
+import math
+import operator
+
+from array import array
+from datetime import date
+from itertools import repeat
+from dataclasses import dataclass, field
+
+from typing import Any
+
+from data_processor import DataTypes, RE_RETRIEVE_RATIO, rfilter_nones
+from util import print_wrn
+
+HOURS_PER_DAY = 24
+
+
+@dataclass
+class HourlyData:
+    """This dataclass represents hourly data points from Tauron API
+    (full+time profile). Values are kept in a compact array, so all
+    aggregations are done without Python loops over single hours.
+
+    Args:
+        first_day (date): Day represented by the first 24 values
+        values (array): Hourly values (padded with 0.0 to whole days)
+        hours (int): How many hours with data are available
+        tariff (str): Tariff name (from contract)
+        data_type (DataTypes): 'oze' or 'consume'
+    """
+    first_day: date
+    values: array
+    hours: int
+    tariff: str
+    data_type: DataTypes
+
+    @classmethod
+    def parseData(cls, data_type: DataTypes,
+                  first_day: date, data: dict[str, Any]) -> 'HourlyData':
+        "Initialize HourlyData from API response"
+        if "values" not in data:
+            raise ValueError("Provided data are in unsupported shape")
+
+        raw_values: list[float | None] = rfilter_nones(data["values"])
+        try:
+            values = array('d', raw_values)
+        except TypeError:
+            # NOTE: Missing hours are treated as hours without energy flow,
+            # so usage (and costs) of such period are understated
+            print_wrn(f"{raw_values.count(None)} hours without {data_type} "
+                      f"data since {first_day} are counted as zeros.")
+            values = array('d', (v or 0.0 for v in raw_values))
+
+        hours = len(values)
+        values.extend(repeat(0.0, -hours % HOURS_PER_DAY))
+
+        return cls(
+            first_day=first_day,
+            values=values,
+            hours=hours,
+            tariff=data.get("tariff", ""),
+            data_type=data_type
+        )
+
+    @property
+    def days(self) -> int:
+        return len(self.values) // HOURS_PER_DAY
+
+    def hourly_profile(self) -> array:
+        """Accumulated energy for each hour of the day"""
+        return hourly_profile(self.values)
+
+
+def daily_sums(hourly_values: array) -> array:
+    # zip over the same iterator groups values into whole days
+    return array('d', map(
+        math.fsum, zip(*[iter(hourly_values)] * HOURS_PER_DAY)))
+
+
+def hourly_profile(hourly_values: array) -> array:
+    return array('d', (math.fsum(hourly_values[hour::HOURS_PER_DAY])
+                       for hour in range(HOURS_PER_DAY)))
+
+
+def hourly_balance(consume_data: HourlyData, oze_data: HourlyData) -> array:
+    """Energy balance for each hour (20% "fee" is taken into account)"""
+    if (consume_data.data_type != DataTypes.consume or
+            oze_data.data_type != DataTypes.oze):
+        raise ValueError("Provided data in a wrong type.")
+
+    if consume_data.first_day != oze_data.first_day:
+        raise ValueError("Provided data are for different days.")
+
+    return array('d', map(
+        operator.sub,
+        map(operator.mul, oze_data.values, repeat(RE_RETRIEVE_RATIO)),
+        consume_data.values))
+
+
+def positive_days(balance: array) -> int:
+    """# days in which we used less energy then we send back to the grid"""
+    return sum(map((0.0).__lt__, daily_sums(balance)))
+
+
+def positive_hours(balance: array) -> array:
+    """# days with positive balance for each hour of the day"""
+    return array('l', (sum(map((0.0).__lt__, balance[hour::HOURS_PER_DAY]))
+                       for hour in range(HOURS_PER_DAY)))
+
+
+@dataclass
+class HourlyProfile:
+    """Energy of each hour of the day accumulated over many days.
+
+    Args:
+        usage (array): Used energy for each hour of the day
+        oze (array): Energy sent to the grid for each hour of the day
+        positive_hours (array): # days with positive balance in each hour
+        positive_days (int): # days with positive (daily) balance
+        days (int): How many days were taken into account
+    """
+    usage: array = field(
+        default_factory=lambda: array('d', repeat(0.0, HOURS_PER_DAY)))
+    oze: array = field(
+        default_factory=lambda: array('d', repeat(0.0, HOURS_PER_DAY)))
+    positive_hours: array = field(
+        default_factory=lambda: array('l', repeat(0, HOURS_PER_DAY)))
+    positive_days: int = 0
+    days: int = 0
+
+    def add(self, consume_data: HourlyData, oze_data: HourlyData) -> None:
+        balance = hourly_balance(consume_data, oze_data)
+        for total, values in ((self.usage, consume_data.hourly_profile()),
+                              (self.oze, oze_data.hourly_profile()),
+                              (self.positive_hours, positive_hours(balance))):
+            total[:] = array(total.typecode, map(operator.add, total, values))
+        self.positive_days += positive_days(balance)
+        self.days += consume_data.days
@@ -0,0 +1,228 @@
+import csv
+
+from datetime import date, datetime
+from itertools import islice
+
+from typing import Any, Callable, Iterable, Iterator
+
+from data_processor import (
+    DataTypes, MonthlyData, MonthSeries, aggregate_months, known_days)
+from month import last_day_of_month
+from util import print_err, print_wrn, print_note
+
+IMPORT_CHUNK_MONTHS = 12  # months aggregated (and saved) at once
+ENCODING = "utf-8-sig"
+
+# Prefixes of values used in the "type" column of eLicznik exports
+CONSUME_NAMES = ("pob", "zu", "consum")  # pobór, zużycie
+OZE_NAMES = ("odd", "oze", "prod")  # oddanie, produkcja
+
+Row = tuple[date, DataTypes, float, str]
+
+
+def parse_data_type(text: str) -> DataTypes | None:
+    text = text.strip().lower()
+    if text.startswith(CONSUME_NAMES):
+        return DataTypes.consume
+    if text.startswith(OZE_NAMES):
+        return DataTypes.oze
+    return None
+
+
+def parse_day(value: Any) -> date:
+    """Day of "YYYY-MM-DD[ HH:MM]" or "DD.MM.YYYY[ HH:MM]" timestamp.
+
+    NOTE: eLicznik marks hours by their end, so the last hour of a day
+    is "24:00" of the same day.
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+
+    text = str(value).strip()[:10]
+    if text[2:3] == ".":
+        return date(int(text[6:10]), int(text[3:5]), int(text[0:2]))
+    return date.fromisoformat(text)
+
+
+def parse_value(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).strip().replace(",", "."))
+
+
+def parse_rows(rows: Iterable[list[Any]], source: str) -> Iterator[Row]:
+    """(day, type, value, tariff) of every (hourly or daily) row"""
+    rows = iter(rows)
+    columns: dict[str, int] = {}
+    # Export might start with some description, header starts with "Data"
+    for header in islice(rows, 20):
+        names = [str(cell or "").strip().lower() for cell in header]
+        if names and names[0].startswith("data"):
+            for idx, name in enumerate(names):
+                if name.startswith("warto"):  # Wartość kWh
+                    columns.setdefault("value", idx)
+                elif name.startswith("rodzaj"):
+                    columns.setdefault("type", idx)
+                elif name.startswith("taryfa"):
+                    columns.setdefault("tariff", idx)
+            break
+
+    if "value" not in columns or "type" not in columns:
+        print_err(f"{source}: unsupported export (no value or type column)")
+
+    value_col, type_col = columns["value"], columns["type"]
+    tariff_col = columns.get("tariff", None)
+    for line, row in enumerate(rows):
+        if not row or not row[0]:
+            continue
+        try:
+            data_type = parse_data_type(str(row[type_col]))
+            if data_type is None:
+                raise ValueError(f"unknown energy type '{row[type_col]}'")
+            yield (
+                parse_day(row[0]),
+                data_type,
+                parse_value(row[value_col]),
+                "" if tariff_col is None else str(row[tariff_col]))
+        except (ValueError, IndexError) as e:
+            print_wrn(f"{source}: row {line + 1} skipped: {e}")
+
+
+def read_export(path: str) -> Iterator[Row]:
+    """Stream rows of CSV or XLSX export (XLSX requires openpyxl)"""
+    if path.lower().endswith(".xlsx"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            print_err("Install openpyxl to import XLSX files "
+                      "(pip install openpyxl).")
+
+        # NOTE: read-only mode doesn't load the whole sheet into memory
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from parse_rows(
+                workbook.active.iter_rows(values_only=True), path)
+        finally:
+            workbook.close()
+        return
+
+    with open(path, newline="", encoding=ENCODING, errors="replace") as f:
+        delimiter = ";" if ";" in f.read(4096) else ","
+        f.seek(0)
+        yield from parse_rows(csv.reader(f, delimiter=delimiter), path)
+
+
+class MonthAccumulator():
+    """Daily sums of a single month (for both energy types)"""
+    def __init__(self, month: date) -> None:
+        self.month = month
+        length = last_day_of_month(month).day
+        self.days: dict[DataTypes, list[float | None]] = {
+            data_type: [None] * length for data_type in DataTypes}
+        self.tariff = ""
+
+    def add(self, day: date, data_type: DataTypes, value: float) -> None:
+        days = self.days[data_type]
+        idx = day.day - 1
+        days[idx] = value if days[idx] is None else days[idx] + value
+
+    def monthly_data(self, data_type: DataTypes) -> MonthlyData | None:
+        """Same shape as from the API (None if no data), missing days
+        between the first and the last one are None"""
+        days = self.days[data_type]
+        present = [idx for idx, value in enumerate(days) if value is not None]
+        if not present:
+            return None
+
+        values = days[present[0]:present[-1] + 1]
+        return MonthlyData(
+            self.month.replace(day=present[0] + 1), values,
+            sum(value for value in values if value is not None),
+            self.tariff, data_type)
+
+
+def import_exports(
+        paths: list[str], installation_date: date,
+        on_month_data: Callable[[list[MonthlyData]], None] | None = None
+        ) -> MonthSeries:
+    """Aggregate eLicznik exports into DataPoints (same as from the API).
+
+    Rows are streamed and only months that are still open are kept in
+    memory. A month is complete when both energy types moved past it,
+    then it's aggregated (in chunks of IMPORT_CHUNK_MONTHS months).
+    NOTE: If all rows of one type come first, months are kept until rows
+    of the other type reach them (daily sums only, never rows).
+    """
+    pending: dict[date, MonthAccumulator] = {}
+    ready: list[MonthAccumulator] = []
+    latest: dict[DataTypes, date] = {}
+    data = MonthSeries()
+    closed: date | None = None  # the last month moved to ready
+    rows_count = 0
+
+    def flush() -> None:
+        consume: dict[date, MonthlyData] = {}
+        oze: dict[date, MonthlyData] = {}
+        for acc in ready:
+            cd = acc.monthly_data(DataTypes.consume)
+            od = acc.monthly_data(DataTypes.oze)
+            if cd is None or od is None:
+                print_wrn(f"Only one energy type for {acc.month:%Y-%m}, "
+                          f"month skipped.")
+                continue
+            consume[acc.month] = cd
+            oze[acc.month] = od
+        ready.clear()
+
+        # NOTE: Daily store skips missing (None) days
+        if on_month_data is not None:
+            on_month_data(list(consume.values()) + list(oze.values()))
+
+        for month in consume:
+            cd, od = known_days(consume[month], oze[month])
+            if cd is not consume[month]:
+                missing = cd.month.replace(day=cd.month.day + len(cd.values))
+                print_wrn(f"Data for {missing} are missing, {month:%Y-%m} "
+                          f"is imported until the day before (use --repair "
+                          f"to download the rest).")
+            consume[month], oze[month] = cd, od
+        data.extend(aggregate_months(consume, oze, installation_date))
+
+    for path in paths:
+        print_note(f"Importing {path}...")
+        for day, data_type, value, tariff in read_export(path):
+            rows_count += 1
+            month = day.replace(day=1)
+            acc = pending.get(month)
+            if acc is None:
+                if closed is not None and month <= closed:
+                    print_wrn(f"Rows of {month:%Y-%m} are not in order, "
+                              f"they were skipped.")
+                    continue
+                acc = pending[month] = MonthAccumulator(month)
+            acc.add(day, data_type, value)
+            acc.tariff = tariff or acc.tariff
+
+            if latest.get(data_type, date.min) >= month:
+                continue
+            latest[data_type] = month
+            if len(latest) < len(DataTypes):
+                continue
+
+            # Months before the latest one of both types are complete
+            done = min(latest.values())
+            for m in sorted(pending):
+                if m >= done:
+                    break
+                ready.append(pending.pop(m))
+                closed = m
+            if len(ready) >= IMPORT_CHUNK_MONTHS:
+                flush()
+
+    ready.extend(pending.pop(m) for m in sorted(pending))
+    flush()
+
+    print_note(f"{rows_count} rows imported into {len(data)} months.")
+    return data
@@ -0,0 +1,190 @@
+import os
+import csv
+
+from bisect import bisect_right
+from datetime import date
+from dataclasses import dataclass
+
+from data_processor import DataPoint, MonthSeries, RE_RETRIEVE_RATIO
+from month import month_ordinal
+from util import print_wrn, print_note
+
+LEDGER_FILE_PATH = "ledger.csv"
+CREDIT_VALIDITY = 12  # months, energy left in the bank expires after that
+
+
+@dataclass(frozen=True, slots=True)
+class LedgerEntry:
+    """Net-metering settlement of a single month (with carry-over state).
+
+    Args:
+        month (date): Settled month (same as DataPoint.month)
+        usage (float): Energy taken from the grid in this month
+        credit (float): Energy that can be retrieved (RE * ratio)
+        to_pay (float): Usage not covered by any credit (own or banked)
+        expired (float): Banked credit that expired in this month
+        total_to_pay (float): Cumulative to_pay of all months so far
+        bank (tuple[float, ...]): Credits left from the last CREDIT_VALIDITY
+                                  months (the oldest first, this month last)
+    """
+    month: date
+    usage: float  # kWh
+    credit: float  # kWh
+    to_pay: float  # kWh
+    expired: float  # kWh
+    total_to_pay: float  # kWh
+    bank: tuple[float, ...]
+
+    @property
+    def banked(self) -> float:
+        return sum(self.bank)
+
+    def matches(self, data_point: DataPoint) -> bool:
+        """Was this entry settled for (exactly) the same data?"""
+        return (self.month == data_point.month and
+                self.usage == data_point.usage and
+                self.credit == data_point.oze * RE_RETRIEVE_RATIO)
+
+    def settle(self, data_point: DataPoint,
+               validity: int = CREDIT_VALIDITY) -> 'LedgerEntry':
+        """Entry for the next month (O(validity), history is not needed)"""
+        # Months without data (if any) are skipped, credits still get older
+        shift = max(1, min(month_ordinal(data_point.month) -
+                           month_ordinal(self.month), validity))
+        return _settle(self.bank[shift:], sum(self.bank[:shift]),
+                       self.total_to_pay, data_point, validity)
+
+    def __iter__(self):
+        """To be used by CSV writer"""
+        return iter([
+            self.month.isoformat(),
+            self.usage,
+            self.credit,
+            self.to_pay,
+            self.expired,
+            self.total_to_pay,
+            *self.bank,
+        ])
+
+
+def _settle(bank: tuple[float, ...], expired: float, total_to_pay: float,
+            data_point: DataPoint, validity: int) -> LedgerEntry:
+    credit = data_point.oze * RE_RETRIEVE_RATIO
+
+    # Energy produced in this month is used first, then the oldest credits
+    own_used = min(credit, data_point.usage)
+    missing = data_point.usage - own_used
+    remaining = list(bank)
+    for idx, banked in enumerate(remaining):
+        if missing <= 0:
+            break
+        used = min(banked, missing)
+        remaining[idx] -= used
+        missing -= used
+
+    remaining += [0.0] * (validity - 1 - len(remaining))
+    remaining.append(credit - own_used)
+
+    return LedgerEntry(
+        month=data_point.month,
+        usage=data_point.usage,
+        credit=credit,
+        to_pay=missing,
+        expired=expired,
+        total_to_pay=total_to_pay + missing,
+        bank=tuple(remaining))
+
+
+class Ledger():
+    """Net-metering settlements of all months (kept in sync with DataPoints).
+
+    Settlement of each month depends only on the previous entry, so adding
+    a month is O(1) and when older data change only entries after the first
+    changed month are settled again.
+    """
+    def __init__(self, entries: list[LedgerEntry] | None = None,
+                 validity: int = CREDIT_VALIDITY) -> None:
+        self.entries = entries or []
+        self.validity = validity
+
+    def update(self, data: MonthSeries) -> int:
+        """Settle months that changed, returns the number of settled months"""
+        start = 0
+        for entry, data_point in zip(self.entries, data):
+            if not entry.matches(data_point):
+                break
+            start += 1
+
+        del self.entries[start:]
+        for data_point in data[start:]:
+            if self.entries:
+                self.entries.append(
+                    self.entries[-1].settle(data_point, self.validity))
+            else:
+                self.entries.append(_settle(
+                    (), 0.0, 0.0, data_point, self.validity))
+
+        return len(data) - start
+
+    def _entry(self, any_day: date, before: bool = False) -> int:
+        """Index of the last entry up to the month (or before the month)"""
+        return bisect_right(
+            self.entries, month_ordinal(any_day) - before,
+            key=lambda entry: month_ordinal(entry.month)) - 1
+
+    def settlement(self, first_day: date,
+                   last_day: date) -> tuple[float, float]:
+        """Energy to pay for the months between first_day and last_day
+        and credit banked at the end of that period."""
+        last = self._entry(last_day)
+        if last < 0:
+            return 0.0, 0.0
+        first = self._entry(first_day, before=True)
+        to_pay = self.entries[last].total_to_pay
+        if first >= 0:
+            to_pay -= self.entries[first].total_to_pay
+        return to_pay, self.entries[last].banked
+
+
+def load_ledger(path: str = LEDGER_FILE_PATH,
+                validity: int = CREDIT_VALIDITY) -> Ledger:
+    entries = []
+    try:
+        with open(path) as csv_file:
+            reader = csv.reader(csv_file, delimiter=';', quotechar='|')
+            for row in reader:
+                if len(row) != 6 + validity:
+                    raise ValueError(
+                        f"each row supposed to have {6 + validity} elements, "
+                        f"{len(row)} found instead.")
+
+                entries.append(LedgerEntry(
+                    date.fromisoformat(row[0]),
+                    float(row[1]),
+                    float(row[2]),
+                    float(row[3]),
+                    float(row[4]),
+                    float(row[5]),
+                    tuple(map(float, row[6:])),
+                ))
+    except FileNotFoundError:
+        pass  # all months will be settled
+    except IOError:
+        print_wrn("Ledger file is not accessible.")
+    except ValueError as e:
+        print_wrn(f"Ledger file is corrupted: {e}")
+        entries = []
+
+    return Ledger(entries, validity)
+
+
+def save_ledger(ledger: Ledger, path: str = LEDGER_FILE_PATH) -> None:
+    print_note("Saving ledger...")
+    # NOTE: File is replaced at once, so readers never see partial content
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as csv_file:
+        writer = csv.writer(
+            csv_file, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+
+        writer.writerows(ledger.entries)
+    os.replace(tmp_path, path)
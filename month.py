@@ -1,14 +1,61 @@
+import calendar
 from datetime import date
-from dateutil import relativedelta as rd
+from itertools import accumulate
+
+# NOTE: dateutil is not used here on purpose, importing it
+# noticeably slows down (offline) start of the script
+
+# Time index: months and days are represented by integer ordinals, so date
+# math in loops (and on whole arrays) doesn't allocate date objects.
+# Month ordinal: year * 12 + month - 1, day ordinal: date.toordinal()
+MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+# Days in a year before the first day of each month (not leap year)
+MONTH_OFFSETS = tuple(accumulate(MONTH_DAYS[:-1], initial=0))
 
 
 def last_day_of_month(any_day: date) -> date:
-    return any_day + rd.relativedelta(day=1, months=+1, days=-1)
+    return any_day.replace(
+        day=calendar.monthrange(any_day.year, any_day.month)[1])
+
+
+def month_lengths(months: list[date]) -> list[int]:
+    return [month_length(month_ordinal(m)) for m in months]
+
+
+def month_ordinal(any_day: date) -> int:
+    """Number of months since year 0 (consecutive months differ by 1)"""
+    return any_day.year * 12 + any_day.month - 1
+
+
+def month_of_ordinal(ordinal: int) -> date:
+    """First day of the month (inverse of month_ordinal)"""
+    return date(ordinal // 12, ordinal % 12 + 1, 1)
+
+
+def month_key(text: str) -> int:
+    """Month ordinal of "YYYY-MM[-DD]" text (e.g. cache row)"""
+    return int(text[:4]) * 12 + int(text[5:7]) - 1
+
+
+def month_length(ordinal: int) -> int:
+    """Number of days in the month"""
+    year, month = divmod(ordinal, 12)
+    return MONTH_DAYS[month] + (month == 1 and calendar.isleap(year))
+
+
+def month_start(ordinal: int) -> int:
+    """Day ordinal of the first day of the month"""
+    year, month = divmod(ordinal, 12)
+    before = year - 1
+    return (before * 365 + before // 4 - before // 100 + before // 400 +
+            MONTH_OFFSETS[month] + (month > 1 and calendar.isleap(year)) + 1)
+
+
+def ordinal_range(first_day: date, last_day: date) -> range:
+    """Ordinals of all months between first_day and last_day (inclusive)"""
+    return range(month_ordinal(first_day), month_ordinal(last_day) + 1)
 
 
-def months_between(date1: date, date2: date) -> int:
-    # NOTE: I used simple math instead of rd.relativedelta(date1, date2)
-    # because I don't care how many months would "fit" between date1 and date2
-    # For example both for date1 = 2020-01-30 and date2 = 2020-02-02 as for
-    # date1 = 2020-01-01 and date2 = 2020-02-28 this function will return 1
-    return abs((date1.year - date2.year) * 12 + date1.month - date2.month)
+def year_ordinals(year: int) -> tuple[int, int]:
+    """Ordinals of the first and the last month of the year"""
+    return year * 12, year * 12 + 11
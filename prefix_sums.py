@@ -0,0 +1,138 @@
+from array import array
+from datetime import date, timedelta
+from itertools import accumulate
+
+from typing import TYPE_CHECKING
+
+from data_processor import (
+    DataTypes, MonthlyData, MonthSeries, RE_RETRIEVE_RATIO)
+from month import last_day_of_month, month_ordinal
+from report import Summary
+
+if TYPE_CHECKING:
+    import sqlite3
+
+
+def parse_range_bound(text: str, end: bool = False) -> tuple[date, bool]:
+    """Parse "YYYY-MM" or "YYYY-MM-DD" date.
+
+    Returns first (or last if end is set) day of the month for
+    month granularity and flag if day was provided.
+    """
+    if len(text) == 7:
+        day = date.fromisoformat(f"{text}-01")
+        return (last_day_of_month(day) if end else day), False
+    return date.fromisoformat(text), True
+
+
+def parse_range(text: str) -> tuple[date, date, bool]:
+    """Parse "FROM..TO" range (e.g. 2023-10..2024-03)"""
+    first, sep, last = text.partition("..")
+    if not sep:
+        raise ValueError(f"Range '{text}' should be in FROM..TO format")
+    first_day, first_is_day = parse_range_bound(first)
+    last_day, last_is_day = parse_range_bound(last, end=True)
+    if first_day > last_day:
+        raise ValueError(f"Range '{text}' ends before it starts")
+    return first_day, last_day, first_is_day or last_is_day
+
+
+def _prefix(values: list[float] | list[int], typecode: str) -> array:
+    return array(typecode, accumulate(values, initial=0))
+
+
+class MonthlyPrefixSums():
+    """Cumulative sums of monthly data (dense, one slot per month).
+
+    Total for any range of months is a difference of two prefix values.
+    """
+    def __init__(self, data: MonthSeries) -> None:
+        self.first = data.ordinals[0] if data else 0
+        size = data.ordinals[-1] - self.first + 1 if data else 0
+
+        usage = [0.0] * size
+        oze = [0.0] * size
+        positive_days = [0] * size
+        months = [0] * size
+        for ordinal, u, o, p in zip(data.ordinals, data.usage, data.oze,
+                                    data.positive_days):
+            idx = ordinal - self.first
+            usage[idx] += u
+            oze[idx] += o
+            positive_days[idx] += p
+            months[idx] = 1
+
+        self.usage = _prefix(usage, 'd')
+        self.oze = _prefix(oze, 'd')
+        self.positive_days = _prefix(positive_days, 'l')
+        self.months = _prefix(months, 'l')
+
+    def _index(self, any_day: date) -> int:
+        # Clamp to available months (prefix arrays have one extra slot,
+        # so the last month is len(self.usage) - 2)
+        return min(max(month_ordinal(any_day) - self.first, 0),
+                   len(self.usage) - 2)
+
+    def summary(self, first_day: date, last_day: date) -> Summary:
+        """Totals of all months between first_day and last_day (inclusive)"""
+        if (len(self.usage) < 2 or
+                month_ordinal(last_day) < self.first or
+                month_ordinal(first_day) >= self.first + len(self.usage) - 1):
+            return Summary()
+
+        a, b = self._index(first_day), self._index(last_day) + 1
+        return Summary(
+            usage=self.usage[b] - self.usage[a],
+            oze=self.oze[b] - self.oze[a],
+            months=self.months[b] - self.months[a],
+            positive_days=self.positive_days[b] - self.positive_days[a])
+
+
+class DailyPrefixSums():
+    """Cumulative sums of daily data (from the daily store)"""
+    def __init__(self, consume: dict[date, MonthlyData],
+                 oze: dict[date, MonthlyData]) -> None:
+        days: dict[date, tuple[float, float]] = {}
+        for month in consume.keys() & oze.keys():
+            first_day = consume[month].month
+            for idx, (c, o) in enumerate(
+                    zip(consume[month].values, oze[month].values)):
+                days[first_day + timedelta(days=idx)] = (c, o)
+
+        self.first = min(days).toordinal() if days else 0
+        size = max(days).toordinal() - self.first + 1 if days else 0
+
+        usage = [0.0] * size
+        oze_values = [0.0] * size
+        for day, (c, o) in days.items():
+            usage[day.toordinal() - self.first] = c
+            oze_values[day.toordinal() - self.first] = o
+
+        self.usage = _prefix(usage, 'd')
+        self.oze = _prefix(oze_values, 'd')
+        self.positive_days = _prefix(
+            [o * RE_RETRIEVE_RATIO - c > 0 for c, o in zip(usage, oze_values)],
+            'l')
+
+    @classmethod
+    def from_store(cls, conn: "sqlite3.Connection",
+                   meter_id: str) -> "DailyPrefixSums":
+        from daily_store import load_monthly_data
+        return cls(load_monthly_data(conn, meter_id, DataTypes.consume),
+                   load_monthly_data(conn, meter_id, DataTypes.oze))
+
+    def summary(self, first_day: date, last_day: date) -> Summary:
+        """Totals of all days between first_day and last_day (inclusive)"""
+        last = len(self.usage) - 1
+        a = min(max(first_day.toordinal() - self.first, 0), last)
+        b = min(max(last_day.toordinal() - self.first + 1, 0), last)
+        if b <= a:
+            return Summary()
+
+        first = date.fromordinal(self.first + a)
+        last = date.fromordinal(self.first + b - 1)
+        return Summary(
+            usage=self.usage[b] - self.usage[a],
+            oze=self.oze[b] - self.oze[a],
+            months=month_ordinal(last) - month_ordinal(first) + 1,
+            positive_days=self.positive_days[b] - self.positive_days[a])
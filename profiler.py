@@ -0,0 +1,99 @@
+import sys
+import json
+import threading
+
+from time import perf_counter
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from typing import Any, Iterator
+
+# Upper bounds (ms) of request latency histogram buckets
+LATENCY_BUCKETS = [50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Profiler():
+    """Collects per-phase wall time and HTTP request statistics.
+
+    Phases with the same name are accumulated (phases executed by worker
+    threads at the same time are summed up as well).
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._start = perf_counter()
+        self.phases: dict[str, dict[str, float]] = {}
+        self.requests: dict[str, dict[str, Any]] = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+        self._start = perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, perf_counter() - start)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            phase = self.phases.setdefault(name, {"calls": 0, "seconds": 0.0})
+            phase["calls"] += 1
+            phase["seconds"] += seconds
+
+    def add_request(self, name: str, seconds: float, size: int) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            stats = self.requests.setdefault(name, {
+                "count": 0,
+                "seconds": 0.0,
+                "bytes": 0,
+                "max_ms": 0.0,
+                "histogram_ms": [0] * (len(LATENCY_BUCKETS) + 1),
+            })
+            ms = seconds * 1000
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += size
+            stats["max_ms"] = max(stats["max_ms"], ms)
+            stats["histogram_ms"][bisect_left(LATENCY_BUCKETS, ms)] += 1
+
+    def report(self) -> dict[str, Any]:
+        buckets = [f"<={b}" for b in LATENCY_BUCKETS] + [
+            f">{LATENCY_BUCKETS[-1]}"]
+        return {
+            "total_seconds": round(perf_counter() - self._start, 6),
+            "phases": {name: {"calls": int(p["calls"]),
+                              "seconds": round(p["seconds"], 6)}
+                       for name, p in self.phases.items()},
+            "requests": {name: {
+                "count": r["count"],
+                "seconds": round(r["seconds"], 6),
+                "bytes": r["bytes"],
+                "max_ms": round(r["max_ms"], 3),
+                "histogram_ms": dict(zip(buckets, r["histogram_ms"])),
+            } for name, r in self.requests.items()},
+        }
+
+    def write_report(self, path: str = "-") -> None:
+        """Write JSON report to the file ("-" means standard error)"""
+        if path == "-":
+            print(json.dumps(self.report(), indent=4), file=sys.stderr)
+            return
+
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=4)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,203 @@
+from datetime import date
+from itertools import groupby
+
+from typing import Iterable, TYPE_CHECKING
+
+import requests
+
+from data_processor import (
+    DataPoint, DataTypes, MonthlyData, MonthSeries, aggregate_months,
+    known_days)
+from month import month_length, month_ordinal, month_of_ordinal, month_start
+from tauron import FetchRange, repair_from_tauron
+from util import print_note, print_wrn
+
+if TYPE_CHECKING:
+    import sqlite3
+
+# Meter almost always uses some energy, so days without any usage are
+# suspicious until they are downloaded again at least that many days later
+# (then the value is confirmed, e.g. nobody was at home)
+CONFIRMATION_DELAY = 7  # days
+
+
+def cache_gaps(data: MonthSeries, installation_date: date) -> list[int]:
+    """Days (ordinals) missing in the cache: months that were never
+    downloaded, months without their first days and past months without
+    their last days.
+
+    Days after the last cached one are not gaps (regular run gets them).
+    """
+    if not data:
+        return []
+
+    first_month = month_ordinal(installation_date)
+    cached = {ordinal: idx for idx, ordinal in enumerate(data.ordinals)}
+    gaps: list[int] = []
+    for ordinal in range(first_month, data.ordinals[-1]):
+        start = month_start(ordinal)
+        end = start + month_length(ordinal)
+        if ordinal == first_month:
+            start = installation_date.toordinal()
+
+        idx = cached.get(ordinal)
+        if idx is None or \
+                month_start(ordinal) + data[idx].month.day - 1 > start:
+            # Never downloaded or first days are missing (e.g. imported),
+            # the whole month is downloaded again
+            gaps.extend(range(start, end))
+        elif not data[idx].is_complete:
+            gaps.extend(range(month_start(ordinal) + data[idx].last_day, end))
+
+    return gaps
+
+
+def store_gaps(conn: "sqlite3.Connection", meter_id: str,
+               installation_date: date) -> list[int]:
+    """Missing or suspicious days (ordinals) in the daily store.
+
+    Only whole months between the first and the last stored day are
+    checked (history before the store was enabled is not a gap).
+    Negative values are suspicious, days without usage only until they
+    are confirmed (see CONFIRMATION_DELAY).
+    """
+    from daily_store import load_days, load_fetch_days
+    consume = load_days(conn, meter_id, DataTypes.consume)
+    oze = load_days(conn, meter_id, DataTypes.oze)
+    if not consume or not oze:
+        return []
+
+    first = max(min(min(consume), min(oze)), installation_date.toordinal())
+    first_month = month_ordinal(date.fromordinal(first))
+    if (first != month_start(first_month) and
+            first != installation_date.toordinal()):
+        # Month stored only partially, it's skipped
+        first = month_start(first_month) + month_length(first_month)
+    last = max(max(consume), max(oze))
+
+    gaps = [day for day in range(first, last + 1)
+            if day not in consume or day not in oze or
+            consume[day] < 0 or oze[day] < 0]
+
+    zero_days = [day for day in range(first, last + 1)
+                 if consume.get(day) == 0.0]
+    if zero_days:
+        fetched = load_fetch_days(conn, meter_id, DataTypes.consume)
+        gaps.extend(day for day in zero_days
+                    if fetched[day] < day + CONFIRMATION_DELAY)
+    return sorted(gaps)
+
+
+def plan_repairs(gaps: Iterable[int], date_today: date,
+                 meter_id: str = "") -> list[FetchRange]:
+    """The smallest set of requests covering all gaps.
+
+    Request can't cross months, so each month with gaps is requested
+    once, from its first to its last missing day.
+    """
+    days = sorted(set(day for day in gaps if day < date_today.toordinal()))
+    plan = []
+    for _, month_days in groupby(
+            map(date.fromordinal, days), key=month_ordinal):
+        month_days = list(month_days)
+        plan.append(FetchRange(
+            [month_days[0]], last_day=month_days[-1], meter_id=meter_id))
+    return plan
+
+
+def patch_month(cached: DataPoint | None,
+                eng_data: dict[DataTypes, MonthlyData],
+                installation_date: date) -> DataPoint | None:
+    """Data point of the month with downloaded days (None if downloaded
+    days can't be applied without the daily store).
+
+    Only days before the first one that is still missing are applied,
+    so the month stays incomplete and the rest is planned again.
+    """
+    consume, oze = known_days(
+        eng_data[DataTypes.consume], eng_data[DataTypes.oze])
+    if not consume.values or not oze.values:
+        return None
+    new = DataPoint.fromMonthlyData(consume, oze, installation_date)
+
+    if cached is None:
+        return new
+    if consume.month.day == cached.last_day + 1:
+        # Days missing at the end of the month
+        return cached.merge(new)
+    if consume.month.day <= cached.month.day and \
+            new.last_day >= cached.last_day:
+        return new
+    return None
+
+
+def run_repair(session: requests.sessions.Session, data: MonthSeries,
+               installation_date: date, date_today: date, meter_id: str,
+               workers: int = 1,
+               conn: "sqlite3.Connection | None" = None,
+               days: Iterable[int] = ()) -> MonthSeries:
+    """Find gaps in local data, download only them and patch months.
+
+    Args:
+        data (MonthSeries): Cached data (not modified)
+        workers (int): How many requests may be sent at the same time
+        conn (sqlite3.Connection): Daily store (if configured), internal
+                                   gaps can be patched only with it
+        days (Iterable[int]): Days requested again anyway (e.g. corrected
+                              by the operator)
+    """
+    gaps = cache_gaps(data, installation_date)
+    if conn is not None:
+        gaps += store_gaps(conn, meter_id, installation_date)
+    gaps.extend(days)
+
+    plan = plan_repairs(gaps, date_today, meter_id)
+    if not plan:
+        print_note("No missing or suspicious days found.")
+        return data
+
+    print_note(f"Repairing {len(plan)} month{'s' if len(plan) > 1 else ''} "
+               f"({len(plan) * len(DataTypes)} requests)...")
+    fetched = repair_from_tauron(session, plan, workers)
+
+    rebuilt: dict[int, DataPoint] = {}
+    if conn is not None and fetched:
+        from daily_store import save_monthly_data, load_monthly_data
+        for eng_data in fetched:
+            save_monthly_data(conn, meter_id, list(eng_data.values()))
+
+        # Whole months are aggregated again from the patched store
+        months = {eng_data[DataTypes.consume].month.replace(day=1)
+                  for eng_data in fetched}
+        consume, oze = (
+            {month: md for month, md in load_monthly_data(
+                conn, meter_id, data_type).items() if month in months}
+            for data_type in (DataTypes.consume, DataTypes.oze))
+        rebuilt = {month_ordinal(dp.month): dp
+                   for dp in aggregate_months(consume, oze, installation_date)}
+
+    patched = MonthSeries()
+    for eng_data in fetched:
+        ordinal = month_ordinal(eng_data[DataTypes.consume].month)
+        start, stop = data.ordinal_bounds(ordinal, ordinal)
+        cached = data[start] if stop > start else None
+
+        dp = rebuilt.get(ordinal)
+        if dp is not None and cached is not None and (
+                dp.month.day > cached.month.day or
+                dp.last_day < cached.last_day):
+            # Store doesn't cover all cached days of this month
+            dp = None
+        if dp is None:
+            dp = patch_month(cached, eng_data, installation_date)
+        if dp is None:
+            print_wrn(f"Days of {month_of_ordinal(ordinal):%Y-%m} were "
+                      f"downloaded, but the month can't be patched (some "
+                      f"days are still missing or daily store is needed, "
+                      f"see 'daily_store').")
+            continue
+        patched.append(dp)
+
+    print_note(f"{len(patched)} of {len(plan)} months repaired.")
+    patched.sort()
+    return data.merge(patched)
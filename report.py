@@ -0,0 +1,411 @@
+from datetime import date
+from dataclasses import dataclass
+
+from typing import Any, TextIO, TYPE_CHECKING
+
+from data_processor import DataPoint, MonthSeries, RE_RETRIEVE_RATIO
+from month import (
+    last_day_of_month, month_length, month_ordinal, month_of_ordinal)
+from table_view import TableView, Cell, CellAlignment, StreamFormat
+from util import balance_color, WIDTH, PRECISION
+
+if TYPE_CHECKING:
+    from hourly import HourlyProfile
+    from ledger import Ledger
+    from prefix_sums import MonthlyPrefixSums, DailyPrefixSums
+    from tariffs import TariffCost
+
+TABLE_HEADER = [
+    ("date", "Date"),
+    ("usage", "Usage"),
+    ("kwh_per_day", "kWh/day"),
+    ("renewable_energy", "RE"),
+    ("renewable_energy_for_use", "RE 2 use"),
+    ("days_with_positive_balance", "(+) days"),
+    ("monthly_balance", "Balance")]
+
+HEATING_SEASON_START = 10  # October, season lasts until September
+
+# Months in a group and month (of a year) the group is aligned to
+GROUPINGS = {
+    "year": (12, 0),
+    "quarter": (3, 0),
+    "season": (12, HEATING_SEASON_START - 1),
+}
+
+
+@dataclass
+class Summary:
+    """Totals of all data points shown in the table.
+
+    Args:
+        usage (float): Accumulated used (taken from grid) energy
+        oze (float): Accumulated energy given back to grid
+        months (int): How many months were taken into account
+        positive_days (int): Days with positive balance
+        to_pay (float): Usage not covered by credits (from the ledger)
+        banked (float): Credit left at the end of the period (from the ledger)
+    """
+    usage: float = 0.0  # kWh
+    oze: float = 0.0  # kWh
+    months: int = 0
+    positive_days: int = 0
+    to_pay: float | None = None  # kWh
+    banked: float | None = None  # kWh
+
+    @property
+    def balance(self) -> float:
+        return self.oze * RE_RETRIEVE_RATIO - self.usage
+
+    def estimated_cost(
+            self, price_kWh: float | None,
+            monthly_fixed_cost: float | None) -> tuple[float, float] | None:
+        """Estimated cost and its fixed part (None if prices are unknown)"""
+        if price_kWh is None or monthly_fixed_cost is None:
+            return None
+
+        if self.to_pay is not None:
+            # Net-metering: only energy not covered by banked credit is paid
+            energy_cost = round(self.to_pay * price_kWh, 2)
+        else:
+            energy_cost = round(
+                (-1 * self.balance * price_kWh if self.balance < 0 else 0.0),
+                2)
+        fixed_cost = self.months * monthly_fixed_cost
+        return energy_cost + fixed_cost, fixed_cost
+
+    def as_dict(self, price_kWh: float | None = None,
+                monthly_fixed_cost: float | None = None) -> dict[str, Any]:
+        cost = self.estimated_cost(price_kWh, monthly_fixed_cost)
+        return {
+            "total_usage": self.usage,
+            "total_renewable_energy": self.oze,
+            "renewable_energy_for_use": self.oze * RE_RETRIEVE_RATIO,
+            "balance": self.balance,
+            "months": self.months,
+            "days_with_positive_balance": self.positive_days,
+            "energy_to_pay": self.to_pay,
+            "banked_renewable_energy": self.banked,
+            "estimated_cost": None if cost is None else cost[0],
+            "fixed_cost": None if cost is None else cost[1],
+        }
+
+
+def fill_table(table: TableView, data: MonthSeries,
+               installation_date: date, date_today: date,
+               first_day: date | None = None, last_day: date | None = None,
+               prefix: "MonthlyPrefixSums | None" = None) -> Summary:
+    """Add monthly rows (and estimation for current month) to the table.
+
+    Only months between first_day and last_day are shown. Summary is taken
+    from prefix sums if provided (otherwise it's accumulated row by row).
+    """
+    table.set_header(TABLE_HEADER)
+    summary = Summary()
+
+    # data is sorted, so selected months are a continuous slice
+    start, stop = data.bounds(first_day, last_day)
+
+    for data_point in data[start:stop]:
+        table.add_row(month_row(data_point, installation_date, date_today))
+
+        if prefix is None:
+            summary.usage += data_point.usage
+            summary.oze += data_point.oze
+            summary.months += 1
+            summary.positive_days += data_point.positive_days
+
+    if prefix is not None and stop > start:
+        summary = prefix.summary(data.month(start), data.month(stop - 1))
+
+    # Print estimation for current month
+    # We need at least one day of data and we don't need estimations
+    # if we chose to analyse period without current month
+    if data and data.ordinals[-1] == month_ordinal(date_today) and (
+            first_day is None or first_day <= date_today) and (
+            last_day is None or date_today <= last_day):
+        add_estimation(table, data[-1], date_today)
+
+    return summary
+
+
+def month_row(data_point: DataPoint, installation_date: date,
+              date_today: date) -> list[Any]:
+    dp_date = data_point.month
+    month = month_ordinal(dp_date)
+
+    days = (month_length(month) if month < month_ordinal(date_today)
+            else date_today.day - 1)
+
+    # corner case: installation day might not be the first day of the month
+    if month == month_ordinal(installation_date):
+        days -= (installation_date.day - 1)
+
+    return [
+        f"{dp_date:%Y-%m}",
+        f"{data_point.usage:.{PRECISION}f}",
+        f"{data_point.usage/days:.{PRECISION}f}",
+        f"{data_point.oze:.{PRECISION}f}",
+        f"{data_point.oze*RE_RETRIEVE_RATIO:.{PRECISION}f}",
+        data_point.positive_days,
+        Cell(data_point.balance, "balance", CellAlignment.RIGHT)
+    ]
+
+
+def estimation_row(data_point: DataPoint, date_today: date) -> list[Any]:
+    days = month_length(month_ordinal(date_today))
+    # we don't get today data so we need to subtract 1 day
+    ratio = days / (date_today.day - 1)
+
+    usage = data_point.usage
+    RE = data_point.oze
+
+    return [
+        f"Estm-{date_today:%m}",
+        f"{ratio*usage:.{PRECISION}f}",
+        f"{ratio*usage/days:.{PRECISION}f}",
+        f"{ratio*RE:.{PRECISION}f}",
+        f"{ratio*RE*RE_RETRIEVE_RATIO:.{PRECISION}f}",
+        int(ratio*data_point.positive_days),
+        Cell(ratio*data_point.balance, "balance", CellAlignment.RIGHT)
+    ]
+
+
+def add_estimation(table: TableView, data_point: DataPoint,
+                   date_today: date) -> None:
+    table.add_divider()
+    table.add_row(estimation_row(data_point, date_today))
+
+
+def compare_ranges(ranges: list[tuple[date, date, bool]],
+                   prefix: "MonthlyPrefixSums",
+                   daily_prefix: "DailyPrefixSums | None",
+                   output_format: str | None, output: TextIO) -> None:
+    """Show totals of each (first day, last day, day granularity) range"""
+    if output_format == "json":
+        table = TableView(col_width=10)
+    else:
+        table = TableView(col_width=10, stream=output,
+                          stream_format=StreamFormat(output_format or "table"))
+    table.set_header([
+        ("from", "From"),
+        ("to", "To"),
+        ("months", "Months"),
+        ("usage", "Usage"),
+        ("renewable_energy", "RE"),
+        ("renewable_energy_for_use", "RE 2 use"),
+        ("days_with_positive_balance", "(+) days"),
+        ("balance", "Balance")])
+
+    for first_day, last_day, is_day in ranges:
+        if is_day and daily_prefix is not None:
+            summary = daily_prefix.summary(first_day, last_day)
+        else:
+            summary = prefix.summary(first_day, last_day)
+        table.add_row([
+            f"{first_day}" if is_day else f"{first_day:%Y-%m}",
+            Cell(f"{last_day}" if is_day else f"{last_day:%Y-%m}",
+                 alignment=CellAlignment.LEFT),
+            summary.months,
+            f"{summary.usage:.{PRECISION}f}",
+            f"{summary.oze:.{PRECISION}f}",
+            f"{summary.oze*RE_RETRIEVE_RATIO:.{PRECISION}f}",
+            summary.positive_days,
+            Cell(summary.balance, "balance", CellAlignment.RIGHT)
+        ])
+
+    if output_format == "json":
+        print(table.to_json(), file=output)
+    else:
+        table.close()
+
+
+def group_period(ordinal: int, grouping: str) -> tuple[str, date, date]:
+    """Label, first and last day of the group containing the month"""
+    length, offset = GROUPINGS[grouping]
+    first = (ordinal - offset) // length * length + offset
+    first_day = month_of_ordinal(first)
+    last_day = last_day_of_month(month_of_ordinal(first + length - 1))
+    if grouping == "quarter":
+        label = f"{first_day.year}-Q{(first_day.month - 1) // 3 + 1}"
+    elif grouping == "season":
+        label = f"{first_day.year}/{last_day.year % 100:02}"
+    else:
+        label = str(first_day.year)
+    return label, first_day, last_day
+
+
+def print_groups(data: MonthSeries, grouping: str,
+                 installation_date: date, date_today: date,
+                 first_day: date | None, last_day: date | None,
+                 prefix: "MonthlyPrefixSums",
+                 daily_prefix: "DailyPrefixSums | None",
+                 ledger: "Ledger", price_kWh: float | None,
+                 monthly_fixed_cost: float | None,
+                 output_format: str | None, output: TextIO) -> None:
+    """Table and summary of each group (year, quarter or heating season).
+
+    Selected months are split into groups and rendered in a single pass.
+    Other formats get one table (with a period column) and no summaries.
+    Estimation is added only to the group with the current month.
+    """
+    start, stop = data.bounds(first_day, last_day)
+
+    # Groups are continuous slices of sorted data
+    groups: list[tuple[str, date, date, int, int]] = []
+    for idx in range(start, stop):
+        if groups and data.ordinals[idx] <= month_ordinal(groups[-1][2]):
+            continue
+        label, group_first, group_last = group_period(
+            data.ordinals[idx], grouping)
+        if groups:
+            groups[-1] = (*groups[-1][:4], idx)
+        groups.append((label, max(group_first, first_day or group_first),
+                       min(group_last, last_day or group_last), idx, stop))
+
+    table = None
+    if output_format == "json":
+        table = TableView()
+    elif output_format is not None:
+        table = TableView(stream=output,
+                          stream_format=StreamFormat(output_format))
+    if table is not None:
+        table.set_header([("period", "Period")] + TABLE_HEADER)
+
+    for label, group_first, group_last, a, b in groups:
+        estimation = (b == len(data) and
+                      data.ordinals[-1] == month_ordinal(date_today) and
+                      group_first <= date_today <= group_last)
+
+        if table is not None:
+            for data_point in data[a:b]:
+                table.add_row([label] + month_row(
+                    data_point, installation_date, date_today))
+            if estimation:
+                table.add_divider()
+                table.add_row([label] + estimation_row(data[-1], date_today))
+            continue
+
+        if a > start:
+            print(file=output)
+        print(f"# {label} #", file=output)
+        group_table = TableView(stream=output)
+        group_table.set_header(TABLE_HEADER)
+        for data_point in data[a:b]:
+            group_table.add_row(
+                month_row(data_point, installation_date, date_today))
+        if estimation:
+            add_estimation(group_table, data[-1], date_today)
+        group_table.close()
+
+        if daily_prefix is not None:
+            # NOTE: Ledger settles whole months only (see main)
+            summary = daily_prefix.summary(group_first, group_last)
+        else:
+            summary = prefix.summary(data.month(a), data.month(b - 1))
+            summary.to_pay, summary.banked = ledger.settlement(
+                group_first, group_last)
+        print_summary(summary, price_kWh, monthly_fixed_cost, output)
+
+    if output_format == "json":
+        print(table.to_json(), file=output)
+    elif table is not None:
+        table.close()
+
+
+def print_tariff_costs(costs: list["TariffCost"], baseline: str | None,
+                       output_format: str | None, output: TextIO) -> None:
+    """Show what each tariff would cost (baseline is marked with *)"""
+    if output_format == "json":
+        table = TableView(col_width=12)
+    else:
+        table = TableView(col_width=12, stream=output,
+                          stream_format=StreamFormat(output_format or "table"))
+    table.set_header([
+        ("tariff", "Tariff"),
+        ("energy_to_pay", "kWh 2 pay"),
+        ("energy_cost", "Energy"),
+        ("fixed_cost", "Fixed"),
+        ("total_cost", "Total"),
+        ("difference", "vs base")])
+
+    base = next((cost for cost in costs if cost.name == baseline), costs[0])
+    for cost in costs:
+        table.add_row([
+            f"{cost.name}{'*' if cost is base else ''}",
+            f"{cost.to_pay:.{PRECISION}f}",
+            f"{cost.energy_cost:.{PRECISION}f}",
+            f"{cost.fixed_cost:.{PRECISION}f}",
+            f"{cost.total:.{PRECISION}f}",
+            f"{cost.total - base.total:+.{PRECISION}f}",
+        ])
+
+    if output_format == "json":
+        print(table.to_json(), file=output)
+    else:
+        table.close()
+
+
+def print_hourly_profile(profile: "HourlyProfile",
+                         output_format: str | None, output: TextIO) -> None:
+    """Energy of each hour of the day (when it's used and produced)"""
+    if output_format == "json":
+        table = TableView()
+    else:
+        table = TableView(stream=output,
+                          stream_format=StreamFormat(output_format or "table"))
+    table.set_header([
+        ("hour", "Hour"),
+        ("usage", "Usage"),
+        ("renewable_energy", "RE"),
+        ("renewable_energy_for_use", "RE 2 use"),
+        ("days_with_positive_balance", "(+) days"),
+        ("balance", "Balance")])
+
+    for hour, (usage, oze, positive) in enumerate(zip(
+            profile.usage, profile.oze, profile.positive_hours)):
+        table.add_row([
+            f"{hour:02}-{hour + 1:02}",
+            f"{usage:.{PRECISION}f}",
+            f"{oze:.{PRECISION}f}",
+            f"{oze * RE_RETRIEVE_RATIO:.{PRECISION}f}",
+            positive,
+            Cell(oze * RE_RETRIEVE_RATIO - usage, "balance",
+                 CellAlignment.RIGHT)])
+
+    if output_format == "json":
+        print(table.to_json(), file=output)
+        return
+    table.close()
+
+    if output_format is None:
+        print(f"> Days:         {profile.days:{WIDTH}}", file=output)
+        print(f"> (+) days:     {profile.positive_days:{WIDTH}}",
+              file=output)
+
+
+def print_summary(summary: Summary, price_kWh: float | None,
+                  monthly_fixed_cost: float | None, output: TextIO) -> None:
+    totalUsage = summary.usage
+    totalRE = summary.oze
+
+    print(f"> Total usage:  {totalUsage:{WIDTH}.{PRECISION}f} kWh",
+          file=output)
+    print(f"> Total RE:     {totalRE:{WIDTH}.{PRECISION}f} kWh",
+          file=output)
+    print(f"> Lost RE:      {totalRE*0.2:{WIDTH}.{PRECISION}f} kWh",
+          file=output)
+    print(f"> RE to use:    {totalRE*RE_RETRIEVE_RATIO:{WIDTH}.{PRECISION}f} kWh",
+          file=output)
+    print(f"> Balance:      {balance_color(summary.balance, WIDTH, 'kWh')}",
+          file=output)
+    if summary.banked is not None:
+        print(f"> Banked RE:    {summary.banked:{WIDTH}.{PRECISION}f} kWh",
+              file=output)
+
+    cost = summary.estimated_cost(price_kWh, monthly_fixed_cost)
+    if cost is None:
+        return
+    estimated_cost, fixed_cost = cost
+    print(f"> Estim. cost:  {estimated_cost:{WIDTH}.{PRECISION}f} PLN (fix. {fixed_cost:.{PRECISION}f} PLN)",
+          file=output)
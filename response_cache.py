@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from typing import Any
+
+from util import print_wrn
+
+RESPONSE_CACHE_DIR_PATH = "responses"
+RESPONSE_CACHE_TTL = 3600  # seconds, for data that might still change
+RESPONSE_CACHE_SIZE_LIMIT = 64 * 1024 * 1024  # bytes
+# Eviction makes some room below the limit, so it's not done on every write
+EVICTION_TARGET = 0.9  # part of the size limit
+
+
+class ResponseCache():
+    """On-disk cache of raw API responses.
+
+    Each response is kept in a separate file (so many processes can share
+    the same directory). Responses for closed periods never expire, others
+    expire after `ttl` seconds. When the size limit is exceeded the least
+    recently used responses are removed (file mtime marks the last use).
+
+    NOTE: Size of the directory is scanned once, then it's tracked with
+    every write, so the directory is scanned again only to evict responses.
+    """
+    def __init__(self, path: str = RESPONSE_CACHE_DIR_PATH,
+                 ttl: float = RESPONSE_CACHE_TTL,
+                 size_limit: int = RESPONSE_CACHE_SIZE_LIMIT) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.size_limit = size_limit
+        os.makedirs(path, exist_ok=True)
+        self._size: int | None = None  # bytes, None until scanned
+        self._size_lock = threading.Lock()
+
+    @staticmethod
+    def key(meter_id: str, data_type: str, profile: str,
+            date_from: str, date_to: str) -> str:
+        return "|".join(
+            (str(meter_id), data_type, profile, date_from, date_to))
+
+    def _file_path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, f"{name}.json")
+
+    def get(self, key: str) -> Any | None:
+        file_path = self._file_path(key)
+        try:
+            with open(file_path) as entry_file:
+                entry = json.load(entry_file)
+        except FileNotFoundError:
+            return None
+        except (IOError, ValueError) as e:
+            print_wrn(f"Cached response is corrupted: {e}")
+            return None
+
+        if entry.get("key") != key:
+            return None
+
+        if (entry["expires_at"] is not None and
+                entry["expires_at"] <= time.time()):
+            return None
+
+        try:
+            os.utime(file_path)  # mark as recently used
+        except OSError:
+            pass
+
+        return entry["data"]
+
+    def put(self, key: str, data: Any, closed: bool) -> None:
+        """Save the response (closed - data for that period won't change)"""
+        entry = {
+            "key": key,
+            "fetched_at": time.time(),
+            "expires_at": None if closed else time.time() + self.ttl,
+            "data": data,
+        }
+
+        file_path = self._file_path(key)
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(file_path)
+        except OSError:
+            old_size = 0
+        try:
+            with open(tmp_path, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, file_path)
+        except IOError as e:
+            print_wrn(f"Unable to save response in cache: {e}")
+            return
+
+        with self._size_lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size - old_size
+            if self._size > self.size_limit:
+                self._size = self.evict()
+
+    def _scan_size(self) -> int:
+        with os.scandir(self.path) as it:
+            return sum(entry.stat().st_size for entry in it
+                       if entry.name.endswith(".json"))
+
+    def evict(self) -> int:
+        """Remove least recently used responses above the size limit,
+        returns size of responses that are left"""
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        if total_size <= self.size_limit:
+            return total_size
+        for _, size, file_path in sorted(entries):
+            if total_size <= self.size_limit * EVICTION_TARGET:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass  # already removed by other process
+            total_size -= size
+        return total_size
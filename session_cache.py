@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import requests
+
+from util import print_wrn, print_note
+
+SESSION_CACHE_FILE_PATH = "session.json"
+
+# Sessions of many accounts can be saved at the same time (batch mode),
+# the store is read, changed and written again under this lock
+_STORE_LOCK = threading.Lock()
+
+
+def _user_key(username: str) -> str:
+    # NOTE: don't keep plain usernames in the file
+    return hashlib.sha256(username.encode()).hexdigest()
+
+
+def _read_store() -> dict[str, list[dict]]:
+    try:
+        with open(SESSION_CACHE_FILE_PATH) as store_file:
+            store = json.load(store_file)
+    except FileNotFoundError:
+        return {}
+    except (IOError, ValueError) as e:
+        print_wrn(f"Session cache is not accessible: {e}")
+        return {}
+
+    return store if isinstance(store, dict) else {}
+
+
+def load_session(username: str) -> requests.sessions.Session | None:
+    """Restore saved session cookies for the user (if not expired)."""
+    cookies = _read_store().get(_user_key(username), [])
+
+    now = time.time()
+    session = requests.Session()
+    for cookie in cookies:
+        if cookie.get("expires") is not None and cookie["expires"] <= now:
+            continue
+        session.cookies.set(
+            cookie["name"], cookie["value"],
+            domain=cookie["domain"], path=cookie["path"],
+            expires=cookie["expires"], secure=cookie["secure"])
+
+    if not session.cookies:
+        return None
+
+    print_note("Saved session found.")
+    return session
+
+
+def save_session(username: str, session: requests.sessions.Session) -> None:
+    """Save session cookies, so next run can skip logging in."""
+    cookies = [{
+        "name": cookie.name,
+        "value": cookie.value,
+        "domain": cookie.domain,
+        "path": cookie.path,
+        "expires": cookie.expires,
+        "secure": cookie.secure,
+    } for cookie in session.cookies]
+
+    with _STORE_LOCK:
+        store = _read_store()
+        store[_user_key(username)] = cookies
+        _write_store(store)
+
+
+def drop_session(username: str) -> None:
+    with _STORE_LOCK:
+        store = _read_store()
+        if store.pop(_user_key(username), None) is not None:
+            _write_store(store)
+
+
+def _write_store(store: dict[str, list[dict]]) -> None:
+    # Session cookies are as good as a password, so only owner can read them
+    tmp_path = (f"{SESSION_CACHE_FILE_PATH}."
+                f"{os.getpid()}.{threading.get_ident()}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as store_file:
+        json.dump(store, store_file)
+    os.replace(tmp_path, SESSION_CACHE_FILE_PATH)
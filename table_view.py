@@ -7,7 +7,7 @@ from io import StringIO
 from enum import Enum
 from dataclasses import dataclass
 
-from typing import Any
+from typing import Any, TextIO
 
 from util import Color, balance_color, PRECISION
 
@@ -19,7 +19,7 @@ class CellAlignment(Enum):
     RIGHT = ">"
 
 
-@dataclass
+@dataclass(slots=True)
 class Cell():
     content: Any
     color: Color | str | None = None
@@ -31,61 +31,129 @@ class Cell():
         return str(self.content)
 
 
-class TableView():
-    headers: list[tuple[str, str]] = []
-    rows: list[list[Any]] = []
+class StreamFormat(Enum):
+    TABLE = "table"
+    CSV = "csv"
+    NDJSON = "ndjson"
+
 
-    def __init__(self, col_width: int = 8) -> None:
+class TableView():
+    """ASCII table
+
+    If stream is provided, rows are written to it (as ASCII table, CSV or
+    NDJSON) as soon as they are added, so nothing is kept in memory.
+    In that case close() has to be called at the end.
+    """
+    def __init__(self, col_width: int = 8,
+                 stream: TextIO | None = None,
+                 stream_format: StreamFormat = StreamFormat.TABLE) -> None:
         self.width = col_width
+        self.stream = stream
+        self.stream_format = stream_format
+        self.headers: list[tuple[str, str]] = []
+        self.rows: list[list[Any]] = []
+        self._header_written = False
+        self._row_templates: dict[int, str] = {}
+        self._csv_writer: Any = None
 
     def __str__(self) -> str:
-        out = ""
-        for h in self.get_header():
-            out += f"| {h:<{self.width}} "
-        out += "|\n"
-
-        length = len(out) - 1
-        line = "-" * length + "\n"
-
-        out = line + out
-        out += line
+        out = StringIO()
+        self.render(out)
+        return out.getvalue()
 
+    def render(self, stream: TextIO) -> None:
+        """Write whole table to the stream"""
+        self._write_header(stream)
         for row in self.rows:
-            if row == LINE:
-                out += line
-                continue
-
-            for i, cell in enumerate(row):
-                if type(cell) is not Cell:
-                    alignment = (CellAlignment.LEFT if i == 0
-                                 else CellAlignment.RIGHT)
-                    cell = Cell(cell, alignment=alignment)
+            stream.write(self._format_row(row))
+        stream.write(self._line)
+
+    def close(self) -> None:
+        """Finish table written to the stream"""
+        if self.stream is None:
+            return
+        if not self._header_written:
+            self._write_stream_header()
+        if self.stream_format == StreamFormat.TABLE:
+            self.stream.write(self._line)
+        self.stream.flush()
+
+    def _write_stream_header(self) -> None:
+        assert self.stream is not None
+        self._header_written = True
+        if self.stream_format == StreamFormat.TABLE:
+            self._write_header(self.stream)
+        elif self.stream_format == StreamFormat.CSV:
+            self._csv_writer = csv.writer(self.stream, delimiter=";")
+            self._csv_writer.writerow(self.get_header(True))
+
+    def _write_header(self, stream: TextIO) -> None:
+        header = "".join(
+            f"| {h:<{self.width}} " for h in self.get_header()) + "|\n"
+
+        line = "-" * (len(header) - 1) + "\n"
+        self._line = line
+
+        stream.write(line + header + line)
+
+    def _row_template(self, columns: int) -> str:
+        # Plain cells: first column is aligned to the left, others to the right
+        if columns not in self._row_templates:
+            self._row_templates[columns] = "".join(
+                f"| {{:{'<' if i == 0 else '>'}{self.width}}} "
+                for i in range(columns)) + "|\n"
+        return self._row_templates[columns]
+
+    def _format_row(self, row: list[Any]) -> str:
+        if row == LINE:
+            return self._line
+
+        if not any(type(cell) is Cell for cell in row):
+            return self._row_template(len(row)).format(*row)
 
-                value = cell.content
-                width = self.width if cell.width is None else cell.width
-
-                if type(cell.color) is Color:
-                    value = f"{cell.color}{value}{Color.END}"
-                    width += len(value) - len(str(cell.content))
+        out = ""
+        for i, cell in enumerate(row):
+            if type(cell) is not Cell:
+                alignment = (CellAlignment.LEFT if i == 0
+                             else CellAlignment.RIGHT)
+                cell = Cell(cell, alignment=alignment)
 
-                elif cell.color == "balance":
-                    value = balance_color(cell.content)
-                    num_width = len(f"{cell.content:.{PRECISION}f}")
-                    width += len(value) - num_width
+            value = cell.content
+            width = self.width if cell.width is None else cell.width
 
-                out += f"| {value:{cell.alignment.value}{width}} "
+            if type(cell.color) is Color:
+                value = f"{cell.color}{value}{Color.END}"
+                width += len(value) - len(str(cell.content))
 
-            out += "|\n"
+            elif cell.color == "balance":
+                value = balance_color(cell.content)
+                num_width = len(f"{cell.content:.{PRECISION}f}")
+                width += len(value) - num_width
 
-        out += line
+            out += f"| {value:{cell.alignment.value}{width}} "
 
-        return out
+        return out + "|\n"
 
     def add_row(self, row: list[Any] = []) -> None:
-        self.rows.append(row)
+        if self.stream is None:
+            self.rows.append(row)
+            return
+
+        if not self._header_written:
+            self._write_stream_header()
+
+        if self.stream_format == StreamFormat.TABLE:
+            self.stream.write(self._format_row(row))
+        elif row == LINE:
+            return
+        elif self.stream_format == StreamFormat.CSV:
+            self._csv_writer.writerow(map(str, row))
+        else:
+            self.stream.write(json.dumps(
+                dict(zip(self.get_header(True), map(str, row)))) + "\n")
 
     def add_divider(self) -> None:
-        self.rows.append(LINE)
+        self.add_row(LINE)
 
     def set_header(self, header: list[tuple[str, str]],
                    config: Any = None) -> None:
@@ -0,0 +1,235 @@
+import operator
+
+from array import array
+from collections import Counter
+from datetime import date, timedelta
+from dataclasses import dataclass, field
+from itertools import repeat
+
+from typing import Any
+
+from data_processor import MonthlyData, MonthSeries, RE_RETRIEVE_RATIO
+from hourly import HourlyData, HOURS_PER_DAY
+from month import month_lengths
+from util import print_err
+
+# Energy is accumulated in buckets: hour of the day for workdays and weekends
+BUCKETS = 2 * HOURS_PER_DAY
+
+
+def bucket(day: date, hour: int = 0) -> int:
+    return (day.weekday() >= 5) * HOURS_PER_DAY + hour
+
+
+@dataclass
+class Tariff:
+    """Tariff definition (from 'tariffs' configuration).
+
+    Args:
+        name (str): Tariff name (e.g. G11, G12w), the same as in contract
+        prices (array): Price of kWh for each bucket (hour of workday
+                        and hour of weekend day)
+        fixed_cost (float): Monthly fixed fees
+        sell_price (float | dict[str, float] | None): Price of energy sent
+                        to the grid (net-billing), single value or price for
+                        each month ("YYYY-MM"); None means net-metering
+        ratio (float): How much energy sent to the grid can be retrieved
+                       (net-metering only)
+    """
+    name: str
+    prices: array
+    fixed_cost: float = 0.0
+    sell_price: float | dict[str, float] | None = None
+    ratio: float = RE_RETRIEVE_RATIO
+
+    def month_sell_price(self, month: date) -> float:
+        if isinstance(self.sell_price, dict):
+            return self.sell_price.get(f"{month:%Y-%m}", 0.0)
+        return self.sell_price or 0.0
+
+    @property
+    def zones(self) -> int:
+        return len(set(self.prices))
+
+
+def parse_tariffs(config: dict[str, Any]) -> list[Tariff]:
+    """Read 'tariffs' list (or a single flat tariff from price/fixed_cost)"""
+    if "tariffs" not in config:
+        if config.get("price", None) is None:
+            print_err("No tariffs configured (see 'tariffs' or 'price').")
+        return [Tariff(
+            "flat", array('d', repeat(float(config["price"]), BUCKETS)),
+            float(config.get("fixed_cost", 0.0) or 0.0))]
+
+    tariffs = []
+    try:
+        for definition in config["tariffs"]:
+            prices = array('d', repeat(float(definition["price"]), BUCKETS))
+            for zone in definition.get("zones", []):
+                price = float(zone["price"])
+                for hour in zone.get("hours", []):
+                    prices[hour] = prices[HOURS_PER_DAY + hour] = price
+                if zone.get("weekends", False):
+                    prices[HOURS_PER_DAY:] = array(
+                        'd', repeat(price, HOURS_PER_DAY))
+
+            sell_price = definition.get("sell_price", None)
+            if isinstance(sell_price, dict):
+                sell_price = {str(month): float(price)
+                              for month, price in sell_price.items()}
+            elif sell_price is not None:
+                sell_price = float(sell_price)
+
+            tariffs.append(Tariff(
+                name=str(definition["name"]),
+                prices=prices,
+                fixed_cost=float(definition.get("fixed_cost", 0.0)),
+                sell_price=sell_price,
+                ratio=float(definition.get("ratio", RE_RETRIEVE_RATIO)),
+            ))
+    except KeyError as e:
+        print_err(f"Key {e} not found in 'tariffs' configuration")
+    except (ValueError, IndexError, TypeError) as e:
+        print_err(f"[Error] Wrong 'tariffs' configuration: {e}")
+
+    if not tariffs:
+        print_err("No tariffs configured (see 'tariffs').")
+    return tariffs
+
+
+@dataclass
+class UsageProfile:
+    """Energy taken from and sent to the grid accumulated in buckets
+    (see BUCKETS) for each month. Series of any resolution are reduced
+    into it in a single pass, then every tariff is evaluated on buckets.
+
+    Args:
+        usage (dict[date, array]): Used energy per bucket (for each month)
+        oze (dict[date, array]): Energy sent to the grid per bucket
+        hourly (bool): Were hours known (otherwise energy is spread evenly)
+        tariffs (Counter): How many days each recorded tariff was used
+    """
+    usage: dict[date, array] = field(default_factory=dict)
+    oze: dict[date, array] = field(default_factory=dict)
+    hourly: bool = True
+    tariffs: Counter = field(default_factory=Counter)
+
+    def _buckets(self, month: date) -> tuple[array, array]:
+        month = month.replace(day=1)
+        if month not in self.usage:
+            self.usage[month] = array('d', repeat(0.0, BUCKETS))
+            self.oze[month] = array('d', repeat(0.0, BUCKETS))
+        return self.usage[month], self.oze[month]
+
+    @property
+    def months(self) -> int:
+        return len(self.usage)
+
+    @property
+    def recorded_tariff(self) -> str | None:
+        """The most often used tariff (from eLicznik data)"""
+        most_common = self.tariffs.most_common(1)
+        return most_common[0][0] if most_common else None
+
+    def add_hourly(self, consume: HourlyData, oze: HourlyData) -> None:
+        self.tariffs[consume.tariff] += consume.days
+        for data, idx_buckets in ((consume, 0), (oze, 1)):
+            for idx in range(data.days):
+                day = data.first_day + timedelta(days=idx)
+                buckets = self._buckets(day)[idx_buckets]
+                start = bucket(day)
+                buckets[start:start + HOURS_PER_DAY] = array('d', map(
+                    operator.add,
+                    buckets[start:start + HOURS_PER_DAY],
+                    data.values[idx * HOURS_PER_DAY:
+                                (idx + 1) * HOURS_PER_DAY]))
+
+    def add_daily(self, consume: list[MonthlyData],
+                  oze: list[MonthlyData]) -> None:
+        """Daily values (hours are unknown, energy is spread evenly)"""
+        self.hourly = False
+        for monthly_data in consume:
+            self.tariffs[monthly_data.tariff] += len(monthly_data.values)
+        for data, idx_buckets in ((consume, 0), (oze, 1)):
+            for monthly_data in data:
+                first_day = monthly_data.month.replace(
+                    day=monthly_data.first_day)
+                for idx, value in enumerate(monthly_data.values):
+                    day = first_day + timedelta(days=idx)
+                    buckets = self._buckets(day)[idx_buckets]
+                    start = bucket(day)
+                    buckets[start:start + HOURS_PER_DAY] = array('d', map(
+                        operator.add, buckets[start:start + HOURS_PER_DAY],
+                        repeat(value / HOURS_PER_DAY, HOURS_PER_DAY)))
+
+    def add_monthly(self, data: MonthSeries) -> None:
+        """Monthly sums (days and hours are unknown, energy is spread)"""
+        self.hourly = False
+        months = [data.month(idx) for idx in range(len(data))]
+        for month, length, usage, oze in zip(
+                months, month_lengths(months), data.usage, data.oze):
+            usage_buckets, oze_buckets = self._buckets(month)
+            weekend_days = sum(
+                month.replace(day=day).weekday() >= 5
+                for day in range(1, length + 1))
+            for weekend, days in ((0, length - weekend_days),
+                                  (1, weekend_days)):
+                share = days / length / HOURS_PER_DAY
+                for hour in range(HOURS_PER_DAY):
+                    usage_buckets[weekend * HOURS_PER_DAY + hour] += \
+                        usage * share
+                    oze_buckets[weekend * HOURS_PER_DAY + hour] += oze * share
+
+
+@dataclass
+class TariffCost:
+    name: str
+    energy_cost: float
+    fixed_cost: float
+    to_pay: float  # kWh
+
+    @property
+    def total(self) -> float:
+        return self.energy_cost + self.fixed_cost
+
+
+def evaluate(tariff: Tariff, profile: UsageProfile) -> TariffCost:
+    months = sorted(profile.usage)
+    fixed_cost = tariff.fixed_cost * len(months)
+
+    if tariff.sell_price is not None:
+        # Net-billing: energy sent to the grid is sold (deposit),
+        # used energy is bought for the price of its zone
+        bought = sold = 0.0
+        to_pay = 0.0
+        for month in months:
+            usage = profile.usage[month]
+            bought += sum(map(operator.mul, usage, tariff.prices))
+            sold += sum(profile.oze[month]) * tariff.month_sell_price(month)
+            to_pay += sum(usage)
+        return TariffCost(
+            tariff.name, round(max(bought - sold, 0.0), 2), fixed_cost, to_pay)
+
+    # Net-metering: energy is settled within each price zone
+    usage_totals = array('d', repeat(0.0, BUCKETS))
+    oze_totals = array('d', repeat(0.0, BUCKETS))
+    for month in months:
+        usage_totals = array('d', map(
+            operator.add, usage_totals, profile.usage[month]))
+        oze_totals = array('d', map(
+            operator.add, oze_totals, profile.oze[month]))
+
+    zones: dict[float, float] = {}
+    for price, usage, oze in zip(tariff.prices, usage_totals, oze_totals):
+        zones[price] = zones.get(price, 0.0) + usage - oze * tariff.ratio
+
+    energy_cost = sum(price * max(balance, 0.0)
+                      for price, balance in zones.items())
+    to_pay = sum(max(balance, 0.0) for balance in zones.values())
+    return TariffCost(tariff.name, round(energy_cost, 2), fixed_cost, to_pay)
+
+
+def compare_tariffs(tariffs: list[Tariff],
+                    profile: UsageProfile) -> list[TariffCost]:
+    return [evaluate(tariff, profile) for tariff in tariffs]
+
@@ -1,25 +1,74 @@
-from datetime import date
+import threading
+
+from datetime import date, timedelta
+from dataclasses import dataclass
+from time import perf_counter, sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from typing import Any, Callable, Iterator
 
 import simplejson
 import requests
-from dateutil import relativedelta as rd
 
 from data_processor import DataTypes, MonthlyData, DataPoint
-from month import months_between, last_day_of_month
+from hourly import HourlyData
+from profiler import PROFILER
+from response_cache import ResponseCache
+from month import (
+    last_day_of_month, month_ordinal, month_of_ordinal, ordinal_range)
+from session_cache import load_session, save_session, drop_session
 from util import print_wrn, print_err, print_note
 
 LOGIN_URL = "https://logowanie.tauron-dystrybucja.pl/login"
 ELICZNIK_URL = "https://elicznik.tauron-dystrybucja.pl"
 DATA_API_URL = f"{ELICZNIK_URL}/energia/api"
+SELECT_METER_URL = f"{ELICZNIK_URL}/ustaw_punkt"
 
 HEADERS = {
     'cache-control': "no-cache",
 }
 
+# Months that failed to download are requested again (one by one)
+FETCH_RETRIES = 3
+RETRY_DELAY = 1.0  # seconds, multiplied by the attempt number
+
+# If set, raw API responses are kept on disk (see enable_response_cache)
+RESPONSE_CACHE: ResponseCache | None = None
+
+
+def enable_response_cache(path: str, ttl: float, size_limit: int) -> None:
+    global RESPONSE_CACHE
+    RESPONSE_CACHE = ResponseCache(path, ttl, size_limit)
+
+
+# If set, limits number of requests in flight (shared by all sessions)
+REQUEST_LIMIT: threading.BoundedSemaphore | None = None
+
+
+def limit_concurrent_requests(limit: int) -> None:
+    global REQUEST_LIMIT
+    REQUEST_LIMIT = threading.BoundedSemaphore(limit)
+
+
+def send_request(session: requests.sessions.Session, method: str, url: str,
+                 name: str, **kwargs: Any) -> requests.Response:
+    """Send HTTP request (latency and size are recorded by profiler)"""
+    if REQUEST_LIMIT is not None:
+        with REQUEST_LIMIT:
+            start = perf_counter()
+            response = session.request(method, url, **kwargs)
+    else:
+        start = perf_counter()
+        response = session.request(method, url, **kwargs)
+    PROFILER.add_request(
+        name, perf_counter() - start, len(response.content))
+    return response
+
 
 def login_to_tauron(
         username: str, password: str,
-        extra_headers: list[dict[str, str]]) -> requests.sessions.Session:
+        extra_headers: list[dict[str, str]],
+        use_session_cache: bool = True) -> requests.sessions.Session:
     payload_login = {
         "username": username,
         "password": password,
@@ -32,34 +81,343 @@ def login_to_tauron(
             continue
         HEADERS[eh["name"]] = eh["value"]
 
+    if use_session_cache:
+        with PROFILER.phase("session_check"):
+            session = load_session(username)
+            if session is not None:
+                if is_session_valid(session):
+                    return session
+                print_note("Saved session expired.")
+                drop_session(username)
+
     print_note("Starting session...")
     # NOTE: Login service require two requests for some reason
-    session = requests.Session()
-    p1 = session.request(
-        "POST", LOGIN_URL, data=payload_login, headers=HEADERS)
-    p2 = session.request(
-        "POST", LOGIN_URL, data=payload_login, headers=HEADERS)
+    with PROFILER.phase("login"):
+        session = requests.Session()
+        p1 = send_request(session, "POST", LOGIN_URL, "login",
+                          data=payload_login, headers=HEADERS)
+        p2 = send_request(session, "POST", LOGIN_URL, "login",
+                          data=payload_login, headers=HEADERS)
 
     if p1.status_code != 200 or p2.status_code != 200:
         print_err(
             "There were some problems with logging to Tauron eLicznik service")
         exit(1)
 
+    if use_session_cache:
+        save_session(username, session)
+
     return session
 
 
+def select_meter(session: requests.sessions.Session, meter_id: str) -> None:
+    """Switch meter used by the session (if account has more of them)"""
+    response = send_request(
+        session, "POST", SELECT_METER_URL, "select_meter",
+        data={"site[client]": meter_id}, headers=HEADERS)
+
+    if response.status_code != 200:
+        print_err(
+            f"HTTP {response.status_code} status code returned "
+            f"while selecting meter {meter_id}")
+
+
+def is_session_valid(session: requests.sessions.Session) -> bool:
+    """Cheap check if eLicznik accepts the session.
+
+    Logged out users are redirected to the login service."""
+    try:
+        response = send_request(
+            session, "GET", ELICZNIK_URL, "session_check",
+            headers=HEADERS, allow_redirects=False)
+    except requests.exceptions.RequestException:
+        return False
+
+    return response.status_code == 200
+
+
+@dataclass
+class FetchRange:
+    """Single API request (per energy type) covering one or more months.
+
+    Args:
+        months (list[date]): Covered months (first one might start mid-month)
+        profile (str): API profile used for this request
+        last_day (date): If defined, request ends on that day
+                         instead of the end of the last month
+        meter_id (str): Meter the data are requested for
+    """
+    months: list[date]
+    profile: str = "month"
+    last_day: date | None = None
+    meter_id: str = ""
+
+    @property
+    def start(self) -> date:
+        return self.months[0]
+
+    @property
+    def end(self) -> date:
+        if self.last_day is not None:
+            return self.last_day
+        return last_day_of_month(self.months[-1])
+
+
+def plan_requests(months: list[date], date_today: date,
+                  coalesce: bool = False,
+                  meter_id: str = "") -> list[FetchRange]:
+    """Find the smallest set of requests covering all provided months.
+
+    Whole past years are requested at once (with "year" profile),
+    remaining months (partial edges) are requested one by one.
+    """
+    if not coalesce:
+        return [FetchRange([month], meter_id=meter_id) for month in months]
+
+    plan: list[FetchRange] = []
+    ordinals = [month_ordinal(month) for month in months]
+    # Only years that already ended can be requested at once
+    current = month_ordinal(date_today)
+    idx = 0
+    while idx < len(months):
+        first = ordinals[idx]
+        if (first % 12 == 0 and months[idx].day == 1 and
+                ordinals[idx + 11:idx + 12] == [first + 11] and
+                first + 11 < current):
+            plan.append(FetchRange(months[idx:idx + 12], "year",
+                                   meter_id=meter_id))
+            idx += 12
+        else:
+            plan.append(FetchRange([months[idx]], meter_id=meter_id))
+            idx += 1
+
+    return plan
+
+
+def fetch_month_from_tauron(
+        session: requests.sessions.Session,
+        iter_date: date,
+        meter_id: str = "") -> dict[DataTypes, MonthlyData]:
+    """Download consume and oze data for a single month."""
+    eng_data: dict[DataTypes, MonthlyData] = {}
+    for eng_type in DataTypes:
+        data = request_data(
+            session, FetchRange([iter_date], meter_id=meter_id), eng_type)
+        if data is not None:
+            with PROFILER.phase("parse"):
+                eng_data[eng_type] = MonthlyData.parseData(
+                    eng_type, iter_date, data)
+
+    return eng_data
+
+
+def request_data(
+        session: requests.sessions.Session,
+        fetch_range: FetchRange,
+        eng_type: DataTypes,
+        fresh: bool = False) -> dict[str, Any] | None:
+    """Data for the range (None if request failed).
+
+    If fresh is set, response cache is not used (but it's still updated).
+    """
+    # NOTE: "new API" specification:
+    # from, to - dates in format %-d.%m.%Y (days w/o leading zero)
+    # type - oze or consum - for energy send and taken from the grid
+    # profile - year, month, full+time - for year / month / day date
+    body = {
+        "from": fetch_range.start.strftime("%-d.%m.%Y"),
+        "to": fetch_range.end.strftime("%-d.%m.%Y"),
+        "type": str(eng_type),
+        "profile": fetch_range.profile,
+    }
+
+    cache_key = ResponseCache.key(
+        fetch_range.meter_id, body["type"], body["profile"],
+        body["from"], body["to"])
+    if RESPONSE_CACHE is not None and not fresh:
+        data = RESPONSE_CACHE.get(cache_key)
+        if data is not None:
+            return data
+
+    # NOTE: Errors are not fatal, failed months are requested again later
+    try:
+        response = send_request(
+            session, "POST", DATA_API_URL, f"data_{fetch_range.profile}",
+            data=body, headers=HEADERS)
+    except requests.RequestException as e:
+        print_wrn(
+            f"Request for {eng_type} data for "
+            f"{fetch_range.start.isoformat()} failed: {e}")
+        return None
+
+    if response.status_code != 200:
+        print_wrn(
+            f"HTTP {response.status_code} status code returned "
+            f"while getting {eng_type} data for "
+            f"{fetch_range.start.isoformat()}")
+    else:
+        # try to parse data
+        try:
+            with PROFILER.phase("json_decode"):
+                data = response.json()["data"]
+        except (simplejson.JSONDecodeError, KeyError, TypeError) as e:
+            print_wrn(
+                f"JSON Decode Error: {e} for {fetch_range.start.isoformat()}")
+        else:
+            if RESPONSE_CACHE is not None:
+                RESPONSE_CACHE.put(
+                    cache_key, data, is_closed(fetch_range, data))
+            return data
+
+    return None
+
+
+def is_closed(fetch_range: FetchRange, data: dict[str, Any]) -> bool:
+    """Won't data of the response change anymore?
+
+    Past months are closed only if values are published for all requested
+    days (eLicznik publishes data with a delay, so e.g. a response fetched
+    on the 1st might miss the last days of the previous month).
+    """
+    if fetch_range.end >= date.today().replace(day=1):
+        return False
+
+    values = data.get("values") if isinstance(data, dict) else None
+    if not values or values[-1] is None:
+        return False
+    days = (fetch_range.end - fetch_range.start).days + 1
+    per_day = 24 if fetch_range.profile == "full+time" else 1
+    return len(values) >= days * per_day
+
+
+def is_complete(eng_data: dict[DataTypes, MonthlyData]) -> bool:
+    """Were both energy types downloaded?"""
+    return len(eng_data) == len(DataTypes)
+
+
+def fetch_range_from_tauron(
+        session: requests.sessions.Session,
+        fetch_range: FetchRange) -> list[dict[DataTypes, MonthlyData]] | None:
+    """Download consume and oze data for all months in the range
+    (None if any of requests failed)."""
+    if len(fetch_range.months) == 1:
+        eng_data_per_month = [fetch_month_from_tauron(
+            session, fetch_range.start, fetch_range.meter_id)]
+        return eng_data_per_month if is_complete(eng_data_per_month[0]) \
+            else None
+
+    eng_data: list[dict[DataTypes, MonthlyData]] = [
+        {} for _ in fetch_range.months]
+    for eng_type in DataTypes:
+        data = request_data(session, fetch_range, eng_type)
+        if data is None:
+            return None
+
+        try:
+            with PROFILER.phase("parse"):
+                monthly_data = MonthlyData.parseRangeData(
+                    eng_type, fetch_range.months, data)
+        except ValueError as e:
+            # NOTE: Some profiles might return aggregated values only,
+            # in that case each month has to be requested separately
+            print_wrn(
+                f"Unable to split {fetch_range.profile} data for "
+                f"{fetch_range.start:%Y-%m} - {fetch_range.end:%Y-%m} ({e}), "
+                f"falling back to monthly requests.")
+            eng_data = [fetch_month_from_tauron(
+                session, month, fetch_range.meter_id)
+                for month in fetch_range.months]
+            return eng_data if all(map(is_complete, eng_data)) else None
+
+        for month_idx, month_data in enumerate(monthly_data):
+            eng_data[month_idx][eng_type] = month_data
+
+    # Skip months without any data at the end of the range
+    while eng_data and eng_data[-1] == {}:
+        eng_data.pop()
+
+    return eng_data if all(map(is_complete, eng_data)) else None
+
+
+def fetch_with_retries(
+        fetch: Callable[[], dict[DataTypes, MonthlyData]]
+        ) -> dict[DataTypes, MonthlyData] | None:
+    """Data of the first attempt that got both energy types
+    (None if all FETCH_RETRIES attempts failed)."""
+    for attempt in range(1, FETCH_RETRIES + 1):
+        eng_data = fetch()
+        if is_complete(eng_data):
+            return eng_data
+        if attempt < FETCH_RETRIES:
+            sleep(RETRY_DELAY * attempt)
+
+    return None
+
+
+def share_connections(session: requests.sessions.Session,
+                      workers: int) -> None:
+    """Share connections of logged in session between all workers"""
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=workers)
+    session.mount(ELICZNIK_URL, adapter)
+
+
+def retry_range_from_tauron(
+        session: requests.sessions.Session,
+        fetch_range: FetchRange
+        ) -> tuple[list[dict[DataTypes, MonthlyData]], bool]:
+    """Download months of the failed range one by one (with retries).
+
+    Returns data of months downloaded before the first one that failed
+    and information if the whole range was downloaded.
+    """
+    eng_data_per_month: list[dict[DataTypes, MonthlyData]] = []
+    for month in fetch_range.months:
+        eng_data = fetch_with_retries(lambda: fetch_month_from_tauron(
+            session, month, fetch_range.meter_id))
+        if eng_data is None:
+            return eng_data_per_month, False
+        eng_data_per_month.append(eng_data)
+
+    return eng_data_per_month, True
+
+
 def gather_and_parse_data_from_tauron(
         session: requests.sessions.Session,
         meter_id: str,
         iter_date: date,
         date_today: date,
         installation_date: date,
-        quiet: bool = False) -> list[DataPoint]:
-    # if date_today > iter_date we will gather additional month (current)
-    # otherwise it's mean that date_today == iter_date (1st day of month)
-    months_to_gather = (
-        months_between(date_today, iter_date) +
-        int(date_today > iter_date) - int(date_today.day == 1))
+        quiet: bool = False,
+        workers: int = 1,
+        coalesce: bool = False,
+        on_month_data: Callable[[list[MonthlyData]], None] | None = None,
+        on_data_points: Callable[[list[DataPoint]], None] | None = None
+        ) -> list[DataPoint]:
+    """Download and aggregate data for all months from iter_date until today.
+
+    Months are aggregated as soon as all earlier months are downloaded
+    (checkpoint), so a failure (or Ctrl-C) doesn't waste months that were
+    already downloaded. Failed ranges are requested again month by month,
+    if that fails too, months since the first failed one are skipped
+    (they are downloaded by the next run).
+
+    Args:
+        workers (int): How many requests may be sent at the same time
+                       (1 means that months are downloaded one by one)
+        coalesce (bool): Download whole past years with a single request
+        on_month_data (Callable): If defined, it's called with raw (daily)
+                                  data of each downloaded month
+        on_data_points (Callable): If defined, it's called with DataPoints
+                                   of each checkpoint (e.g. to save cache)
+    """
+    # All months until yesterday (today's data are not available yet),
+    # the first one starts with iter_date (e.g. partial month from cache)
+    months: list[date] = []
+    if iter_date < date_today:
+        ordinals = ordinal_range(iter_date, date_today - timedelta(days=1))
+        months = [iter_date] + [month_of_ordinal(o) for o in ordinals[1:]]
+    months_to_gather = len(months)
 
     if not quiet:
         print_note(
@@ -67,49 +425,187 @@ def gather_and_parse_data_from_tauron(
             f"month{'s' if months_to_gather > 1 else ''}... ")
         if months_to_gather > 1:
             print("[", end='', flush=True)
-    data: list[DataPoint] = []
-    while (iter_date < date_today):
-        # NOTE: "new API" specification:
-        # from, to - dates in format %-d.%m.%Y (days w/o leading zero)
-        # type - oze or consum - for energy send and taken from the grid
-        # profile - year, month, full+time - for year / month / day date
-
-        eng_data: dict[DataTypes, MonthlyData] = {}
-        for eng_type in DataTypes:
-            body = {
-                "from": iter_date.strftime("%-d.%m.%Y"),
-                "to": last_day_of_month(iter_date).strftime("%-d.%m.%Y"),
-                "type": str(eng_type),
-                "profile": "month",
-            }
-
-            response = session.request(
-                "POST", DATA_API_URL, data=body, headers=HEADERS)
-
-            if response.status_code != 200:
-                print_err(
-                    f"HTTP {response.status_code} status code returned"
-                    f"while getting {eng_type} data for "
-                    f"{iter_date.isoformat()}")
-            else:
-                # try to parse data
-                try:
-                    eng_data[eng_type] = MonthlyData.parseData(
-                        eng_type, iter_date, response.json()["data"])
-                except simplejson.JSONDecodeError as e:
-                    print_err(
-                        f"JSON Decode Error: {e} for {iter_date.isoformat()}")
-
-        data.append(DataPoint.fromMonthlyData(
-            eng_data[DataTypes.consume],
-            eng_data[DataTypes.oze],
-            installation_date))
-
-        iter_date += rd.relativedelta(months=+1, day=1)
 
+    plan = plan_requests(months, date_today, coalesce, meter_id)
+
+    def show_progress(fetch_range: FetchRange) -> None:
         if not quiet and months_to_gather > 1:
-            print(".", end='', flush=True)
+            print("." * len(fetch_range.months), end='', flush=True)
+
+    # How long it took to download each range (only if profiling)
+    timings: dict[int, float] = {}
+
+    def fetch(idx: int) -> list[dict[DataTypes, MonthlyData]] | None:
+        start = perf_counter()
+        eng_data = fetch_range_from_tauron(session, plan[idx])
+        if PROFILER.enabled:
+            timings[idx] = perf_counter() - start
+        return eng_data
+
+    # Downloaded ranges (None if failed) waiting for the earlier ones
+    results: dict[int, list[dict[DataTypes, MonthlyData]] | None] = {}
+    next_idx = 0
+    new_data: list[DataPoint] = []
+
+    def checkpoint() -> None:
+        """Aggregate ranges downloaded without any gaps before them"""
+        nonlocal next_idx
+        consume_data: list[MonthlyData] = []
+        oze_data: list[MonthlyData] = []
+        while results.get(next_idx) is not None:
+            for eng_data in results.pop(next_idx):
+                if on_month_data is not None:
+                    on_month_data(list(eng_data.values()))
+                consume_data.append(eng_data[DataTypes.consume])
+                oze_data.append(eng_data[DataTypes.oze])
+            next_idx += 1
+
+        if not consume_data:
+            return
+        with PROFILER.phase("aggregate"):
+            data_points = DataPoint.fromMonthlyBatch(
+                consume_data, oze_data, installation_date)
+        new_data.extend(data_points)
+        if on_data_points is not None:
+            on_data_points(data_points)
+
+    try:
+        if workers > 1 and len(plan) > 1:
+            share_connections(session, workers)
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = {
+                    executor.submit(fetch, idx): idx
+                    for idx in range(len(plan))}
+                for future in as_completed(futures):
+                    # NOTE: re-raises errors (and exits) from workers
+                    results[futures[future]] = future.result()
+                    show_progress(plan[futures[future]])
+                    checkpoint()
+            finally:
+                # NOTE: on Ctrl-C requests that didn't start are dropped
+                executor.shutdown(cancel_futures=True)
+        else:
+            for idx, fetch_range in enumerate(plan):
+                results[idx] = fetch(idx)
+                show_progress(fetch_range)
+                checkpoint()
+    except KeyboardInterrupt:
+        if not quiet and months_to_gather > 1:
+            print("]")
+        print_wrn("Download interrupted, downloaded months are kept. "
+                  "Run again to continue.")
+        return new_data
+
     if not quiet and months_to_gather > 1:
         print("]")
 
-    return data
+    for idx, seconds in sorted(timings.items()):
+        print_note(
+            f"Data for {plan[idx].start:%Y-%m} - {plan[idx].end:%Y-%m} "
+            f"downloaded", elapsed=seconds)
+
+    # Ranges that failed are downloaded again (in order, month by month)
+    while next_idx < len(plan):
+        fetch_range = plan[next_idx]
+        print_note(f"Downloading data for {fetch_range.start:%Y-%m} - "
+                   f"{fetch_range.end:%Y-%m} again...")
+        try:
+            eng_data_per_month, complete = retry_range_from_tauron(
+                session, fetch_range)
+        except KeyboardInterrupt:
+            eng_data_per_month, complete = [], False
+        if not complete:
+            # Months after the failed one can't be used (no gaps allowed),
+            # months downloaded before it are still used
+            results.clear()
+        results[next_idx] = eng_data_per_month
+        checkpoint()
+        if not complete:
+            failed = fetch_range.months[len(eng_data_per_month)]
+            print_wrn(f"Unable to download data for {failed:%Y-%m}, "
+                      f"run again to continue from that month.")
+            break
+
+    return new_data
+
+
+def fetch_days_from_tauron(
+        session: requests.sessions.Session,
+        fetch_range: FetchRange) -> dict[DataTypes, MonthlyData]:
+    """Download consume and oze data for days of a single month
+    (always from the API, e.g. to replace data corrected by the operator)."""
+    eng_data: dict[DataTypes, MonthlyData] = {}
+    for eng_type in DataTypes:
+        data = request_data(session, fetch_range, eng_type, fresh=True)
+        if data is None:
+            continue
+        with PROFILER.phase("parse"):
+            eng_data[eng_type] = MonthlyData.parseData(
+                eng_type, fetch_range.start, data)
+
+    return eng_data
+
+
+def repair_from_tauron(
+        session: requests.sessions.Session,
+        plan: list[FetchRange],
+        workers: int = 1) -> list[dict[DataTypes, MonthlyData]]:
+    """Download all (day-ranged) requests of the repair plan.
+
+    Ranges are downloaded concurrently (each one is retried), ranges that
+    still fail are skipped (they are planned again by the next repair).
+    """
+    def fetch(fetch_range: FetchRange) -> dict[DataTypes, MonthlyData]:
+        eng_data = fetch_with_retries(
+            lambda: fetch_days_from_tauron(session, fetch_range))
+        if eng_data is None:
+            print_wrn(f"Unable to download data for {fetch_range.start} - "
+                      f"{fetch_range.end}, run repair again later.")
+            return {}
+        return eng_data
+
+    if workers > 1 and len(plan) > 1:
+        share_connections(session, workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(fetch, plan))
+    else:
+        results = list(map(fetch, plan))
+
+    return [eng_data for eng_data in results if is_complete(eng_data)]
+
+
+def gather_hourly_data_from_tauron(
+        session: requests.sessions.Session,
+        first_day: date,
+        last_day: date,
+        meter_id: str = "") -> dict[DataTypes, HourlyData]:
+    """Download hourly consume and oze data for provided days."""
+    hourly_data: dict[DataTypes, HourlyData] = {}
+    for eng_type in DataTypes:
+        fetch_range = FetchRange(
+            [first_day], "full+time", last_day, meter_id)
+        data = request_data(session, fetch_range, eng_type)
+        if data is not None:
+            hourly_data[eng_type] = HourlyData.parseData(
+                eng_type, first_day, data)
+
+    return hourly_data
+
+
+def gather_hourly_range_from_tauron(
+        session: requests.sessions.Session,
+        first_day: date,
+        last_day: date,
+        meter_id: str = ""
+        ) -> Iterator[tuple[date, date, dict[DataTypes, HourlyData]]]:
+    """Download hourly data for a long period (one request per year).
+
+    Yields first and last day of each chunk with its data (data of both
+    types are not available if any request failed).
+    """
+    while first_day <= last_day:
+        chunk_end = min(date(first_day.year, 12, 31), last_day)
+        yield first_day, chunk_end, gather_hourly_data_from_tauron(
+            session, first_day, chunk_end, meter_id)
+        first_day = date(first_day.year + 1, 1, 1)
@@ -1,16 +1,28 @@
+import sys
+import atexit
 import argparse
-from datetime import date
+from datetime import date, timedelta
+from time import perf_counter
+from functools import partial
 
-from dateutil import relativedelta as rd
+from typing import Iterator, TYPE_CHECKING
 
 from config import load_config
 from data_processor import (
-    DataPoint, RE_RETRIEVE_RATIO, load_cache, save_cache)
-from month import last_day_of_month
-from table_view import TableView, Cell, CellAlignment
-from tauron import login_to_tauron, gather_and_parse_data_from_tauron
-from util import (
-    balance_color, WIDTH, PRECISION, print_err, print_note)
+    DataPoint, DataTypes, MonthSeries, load_cache, save_cache, first_missing_day,
+    extend_data)
+from ledger import load_ledger, save_ledger, CREDIT_VALIDITY
+from prefix_sums import (
+    MonthlyPrefixSums, DailyPrefixSums, parse_range, parse_range_bound)
+from profiler import PROFILER
+from report import (
+    fill_table, print_summary, print_groups, compare_ranges,
+    print_tariff_costs, print_hourly_profile, GROUPINGS)
+from table_view import TableView, StreamFormat
+from util import print_err, print_wrn, print_note
+
+if TYPE_CHECKING:
+    from hourly import HourlyData
 
 
 def main() -> None:
@@ -22,6 +34,28 @@ def main() -> None:
         '-y', '--year',
         dest='data_year', nargs='?', const=date_today.year, type=int,
         help='If provided, only data from selected year will be analysed.')
+    parser.add_argument(
+        '--from', dest='date_from', metavar='DATE',
+        help='Analyse data since DATE (YYYY-MM or YYYY-MM-DD).')
+    parser.add_argument(
+        '--to', dest='date_to', metavar='DATE',
+        help='Analyse data until DATE (YYYY-MM or YYYY-MM-DD).')
+    parser.add_argument(
+        '--compare', nargs='+', metavar='RANGE',
+        help='Show totals of each FROM..TO range (e.g. 2023-10..2024-03) '
+             'instead of monthly data.')
+    parser.add_argument(
+        '-g', '--group', choices=list(GROUPINGS),
+        help='Show table and summary of each year, quarter or heating '
+             'season (October - September) in a single run.')
+    parser.add_argument(
+        '--tariffs', action='store_true',
+        help='Show what each configured tariff (see "tariffs") would cost '
+             'in selected period instead of monthly data.')
+    parser.add_argument(
+        '--hours', action='store_true',
+        help='Show usage, renewable energy and balance of each hour of '
+             'the day in selected period (hourly data are downloaded).')
     parser.add_argument(
         '--no-cache',
         dest='use_cache', action='store_false', help='Don\'t use cache.'
@@ -31,13 +65,62 @@ def main() -> None:
         help='Don\'t download data from the Tauron eLicznik.'
     )
     parser.add_argument(
-        '-f', '--format', nargs='?', choices=["csv", "json"],
-        help="Simplify output (showing only table) and use csv or json format."
+        '--rebuild', dest='rebuild', action='store_true',
+        help='Rebuild monthly data from the daily store (implies offline).'
+    )
+    parser.add_argument(
+        '-f', '--format', nargs='?', choices=["csv", "json", "ndjson"],
+        help="Simplify output (showing only table) and use csv, json "
+             "or ndjson (one json object per line) format."
+    )
+    parser.add_argument(
+        '--repair', nargs='?', const='', metavar='RANGE',
+        help="Download again only days that are missing or suspicious "
+             "in the cache (and daily store) and patch them. Days of FROM..TO "
+             "range (e.g. corrected by the operator) are downloaded anyway."
+    )
+    parser.add_argument(
+        '--import', dest='import_files', nargs='+', metavar='FILE',
+        help="Import eLicznik CSV (or XLSX) exports with hourly or daily "
+             "data into the cache (no requests are needed for that period)."
+    )
+    parser.add_argument(
+        '--profile', nargs='?', const='-', metavar='FILE',
+        help="Measure time of each phase and HTTP requests, "
+             "write JSON report to the file (or standard error)."
+    )
+    parser.add_argument(
+        '--serve', metavar='ADDRESS',
+        help="Run as a daemon serving /table, /json and /summary over HTTP "
+             "on host:port or Unix socket (path). Data are refreshed "
+             "in the background."
+    )
+    parser.add_argument(
+        '-o', '--output', type=argparse.FileType('w'), default=sys.stdout,
+        help="Write table to the file instead of standard output."
     )
 
     args = parser.parse_args()
 
-    config = load_config()
+    if args.profile is not None:
+        PROFILER.enable()
+        # Report is written no matter where the script ends
+        atexit.register(PROFILER.write_report, args.profile)
+
+    with PROFILER.phase("config"):
+        config = load_config()
+
+    if args.serve is not None:
+        from daemon import run_daemon
+        run_daemon(config, args)
+        exit()
+
+    if "meters" in config:
+        # Batch mode (many meters / accounts in one run)
+        from batch import run_batch
+        run_batch(config, args, date_today)
+        exit()
+
     try:
         # Required:
         meter_id = config["meter_id"]
@@ -48,6 +131,15 @@ def main() -> None:
         # Optional:
         price_kWh = config.get("price", None)
         monthly_fixed_cost = config.get("fixed_cost", None)
+        workers = int(config.get("workers", 1))
+        coalesce = bool(config.get("coalesce_requests", False))
+        session_cache = bool(config.get("session_cache", True))
+        daily_store_path = config.get("daily_store", None)
+        response_cache_path = config.get("response_cache", None)
+        response_cache_ttl = float(config.get("response_cache_ttl", 3600))
+        response_cache_size = int(
+            config.get("response_cache_size_mb", 64)) * 1024 * 1024
+        credit_validity = int(config.get("credit_validity", CREDIT_VALIDITY))
     except KeyError as e:
         print_err(f"Key {e} not found in config file")
         exit(1)
@@ -55,7 +147,7 @@ def main() -> None:
         print_err(f"[Error] {e}")
         exit(1)
 
-    all_data: list[DataPoint] = []
+    all_data = MonthSeries()
     iter_date = installation_date
 
     if args.data_year is not None:
@@ -72,144 +164,290 @@ def main() -> None:
         if iter_date.year < args.data_year:
             iter_date = date(args.data_year, 1, 1)
 
-    if not args.use_cache and args.offline:
+    # Selected period (-y is the same as --from YYYY-01 --to YYYY-12)
+    first_day = last_day = None
+    day_ranges = False
+    if args.data_year is not None:
+        first_day = date(args.data_year, 1, 1)
+        last_day = date(args.data_year, 12, 31)
+    ranges: list[tuple[date, date, bool]] = []
+    try:
+        if args.date_from is not None:
+            first_day, is_day = parse_range_bound(args.date_from)
+            day_ranges |= is_day
+        if args.date_to is not None:
+            last_day, is_day = parse_range_bound(args.date_to, end=True)
+            day_ranges |= is_day
+        for text in args.compare or []:
+            ranges.append(parse_range(text))
+        repair_days = range(0)
+        if args.repair:
+            repair_first, repair_last, _ = parse_range(args.repair)
+            repair_days = range(
+                max(repair_first, installation_date).toordinal(),
+                repair_last.toordinal() + 1)
+    except ValueError as e:
+        print_err(f"[Error] {e}")
+    day_ranges |= any(is_day for _, _, is_day in ranges)
+
+    if first_day is not None and iter_date < first_day.replace(day=1):
+        iter_date = first_day.replace(day=1)
+
+    # NOTE: Modules that are not always needed are imported on demand,
+    # so offline runs start faster
+    daily_store = None
+    if daily_store_path is not None:
+        from daily_store import (
+            open_store, save_monthly_data, rebuild_datapoints)
+        with PROFILER.phase("daily_store"):
+            daily_store = open_store(daily_store_path)
+
+    if args.rebuild:
+        if daily_store is None:
+            print_err("Daily store is not configured (see 'daily_store').")
+        args.offline = True
+        args.use_cache = False
+        with PROFILER.phase("daily_store"):
+            all_data.extend(
+                rebuild_datapoints(daily_store, meter_id, installation_date))
+
+    if (not args.use_cache and args.offline and not args.rebuild and
+            not args.import_files):
         print_note("There are no data to process. Use cache or online mode.")
         exit(0)
 
     if args.use_cache:
         print_note("Loading cache data...")
-        cache_data = sorted(load_cache(), key=(lambda x: x.month))
-        if cache_data != []:
+        with PROFILER.phase("cache_load"):
+            cache_data = load_cache()
+        if cache_data:
             all_data.extend(cache_data)
 
-            # find last date kept in cache
-            last_date_in_cache = cache_data[-1].month
-            iter_date = last_date_in_cache + rd.relativedelta(months=+1, day=1)
+            # continue from the day after the last one kept in cache
+            iter_date = first_missing_day(cache_data, iter_date)
+
+    if args.import_files:
+        from importer import import_exports
+
+        on_month_data = None
+        if daily_store is not None:
+            on_month_data = partial(save_monthly_data, daily_store, meter_id)
+
+        with PROFILER.phase("import"):
+            imported = import_exports(
+                args.import_files, installation_date, on_month_data)
+        if imported:
+            all_data = all_data.merge(imported)
+            iter_date = first_missing_day(all_data, iter_date)
+            if args.use_cache:
+                with PROFILER.phase("cache_save"):
+                    save_cache(all_data)
+
+    if args.repair is not None and args.offline:
+        print_err("Repair requires online mode.")
+    if args.hours and args.offline:
+        print_err("Hourly data are available only in online mode.")
 
-    if iter_date == date_today:
-        print_note(
-            "Today is the first day of the month. "
-            "All available data points were loaded from cache.")
+    session = None
+    if iter_date >= date_today:
+        print_note("All available data points were loaded from cache.")
     elif not args.offline:
-        session = login_to_tauron(username, password, config["extra_headers"])
-        processed_data = gather_and_parse_data_from_tauron(
-            session, meter_id, iter_date, date_today, installation_date,
-            args.format is not None)
+        from tauron import (
+            login_to_tauron, gather_and_parse_data_from_tauron,
+            enable_response_cache)
 
-        if len(processed_data):
-            date_of_last_dp = processed_data[-1].month + rd.relativedelta(
-                day=processed_data[-1].days)
+        if response_cache_path is not None:
+            enable_response_cache(
+                response_cache_path, response_cache_ttl, response_cache_size)
 
-            all_data.extend(processed_data)
+        session = login_to_tauron(
+            username, password, config["extra_headers"], session_cache)
 
-            print_note(f"Last day with useful data is {date_of_last_dp}")
+        on_month_data = None
+        if daily_store is not None:
+            on_month_data = partial(save_monthly_data, daily_store, meter_id)
+
+        def checkpoint(new_data: list[DataPoint]) -> None:
+            # Partial month from cache is extended with newly gathered days
+            extend_data(all_data, new_data)
+            if args.use_cache:
+                # Saved after every downloaded part, so the next run
+                # continues from here if this one fails
+                with PROFILER.phase("cache_save"):
+                    save_cache(all_data, quiet=True)
+
+        with PROFILER.phase("fetch"):
+            processed_data = gather_and_parse_data_from_tauron(
+                session, meter_id, iter_date, date_today, installation_date,
+                args.format is not None, workers, coalesce, on_month_data,
+                checkpoint)
 
+        if len(processed_data):
+            date_of_last_dp = all_data[-1].month.replace(
+                day=all_data[-1].last_day)
+            print_note(f"Last day with useful data is {date_of_last_dp}")
+            if args.use_cache:
+                print_note("Cache saved.")
+
+    if args.repair is not None:
+        from tauron import login_to_tauron, enable_response_cache
+        from repair import run_repair
+
+        if session is None:
+            if response_cache_path is not None:
+                enable_response_cache(response_cache_path,
+                                      response_cache_ttl, response_cache_size)
+            session = login_to_tauron(
+                username, password, config["extra_headers"], session_cache)
+
+        with PROFILER.phase("repair"):
+            repaired = run_repair(
+                session, all_data, installation_date, date_today, meter_id,
+                workers, daily_store, repair_days)
+        if repaired != all_data:
+            all_data = repaired
             if args.use_cache:
-                # TODO: consider skipping saving cache,
-                # if we don't get any new data
-                save_cache(all_data, date_of_last_dp)
+                with PROFILER.phase("cache_save"):
+                    save_cache(all_data)
+
+    # Net-metering settlement, only changed months are settled again
+    with PROFILER.phase("ledger"):
+        ledger = load_ledger(validity=credit_validity)
+        if ledger.update(all_data) and args.use_cache:
+            save_ledger(ledger)
 
     # print data
     if args.data_year is not None:
         print_note(f"# Data for {args.data_year} year only! #")
+    if args.date_from is not None or args.date_to is not None:
+        print_note(f"# Data from {args.date_from or 'the beginning'} "
+                   f"to {args.date_to or 'today'} only! #")
+
+    render_start = perf_counter()
+    # NOTE: Totals of any range are computed from prefix sums
+    prefix = MonthlyPrefixSums(all_data)
+    daily_prefix = None
+    if day_ranges:
+        if daily_store is not None:
+            daily_prefix = DailyPrefixSums.from_store(daily_store, meter_id)
+        else:
+            print_wrn("Daily store is not configured (see 'daily_store'), "
+                      "whole months are taken into account.")
+
+    # Whole days of the selected period (until yesterday)
+    period_start = max(first_day or installation_date, installation_date)
+    period_end = min(last_day or date_today, date_today - timedelta(days=1))
+
+    def hourly_data() -> Iterator[tuple["HourlyData", "HourlyData"]]:
+        """Hourly consume and oze data of the period (year by year)"""
+        from tauron import (
+            login_to_tauron, gather_hourly_range_from_tauron,
+            enable_response_cache)
+        if response_cache_path is not None:
+            enable_response_cache(
+                response_cache_path, response_cache_ttl, response_cache_size)
+        session = login_to_tauron(
+            username, password, config["extra_headers"], session_cache)
+        missing = []
+        for chunk_start, chunk_end, hourly in gather_hourly_range_from_tauron(
+                session, period_start, period_end, meter_id):
+            if len(hourly) != len(DataTypes):
+                missing.append(f"{chunk_start} - {chunk_end}")
+                continue
+            yield hourly[DataTypes.consume], hourly[DataTypes.oze]
+        if missing:
+            # NOTE: Totals of a shorter period would look complete
+            print_err(f"Unable to download hourly data for "
+                      f"{', '.join(missing)}, run again later "
+                      f"(or use --offline).")
+
+    if args.hours:
+        from hourly import HourlyProfile
+        hourly_profile = HourlyProfile()
+        with PROFILER.phase("hours"):
+            for consume, oze in hourly_data():
+                hourly_profile.add(consume, oze)
+        print_hourly_profile(hourly_profile, args.format, args.output)
+        PROFILER.add_phase("render", perf_counter() - render_start)
+        exit()
 
-    table = TableView()
-    table.set_header([
-        ("date", "Date"),
-        ("usage", "Usage"),
-        ("kwh_per_day", "kWh/day"),
-        ("renewable_energy", "RE"),
-        ("renewable_energy_for_use", "RE 2 use"),
-        ("days_with_positive_balance", "(+) days"),
-        ("monthly_balance", "Balance")])
-
-    totalUsage = 0.0
-    totalRE = 0.0
-    months = 0
-
-    for data_point in all_data:
-        dp_date = data_point.month
-        usage = data_point.usage
-        RE = data_point.oze
-        balance = data_point.balance
-        positive_days = data_point.positive_days
-
-        # If specific year is selected skip others
-        if args.data_year is not None and dp_date.year != args.data_year:
-            continue
-
-        lastDay = last_day_of_month(dp_date)
-        days = lastDay.day if lastDay < date_today else date_today.day - 1
-
-        # corner case: installation day might not be the first day of the month
-        if (dp_date.month == installation_date.month and
-                dp_date.year == installation_date.year):
-            days -= (installation_date.day - 1)
-
-        table.add_row([
-            f"{dp_date:%Y-%m}",
-            f"{usage:.{PRECISION}f}",
-            f"{usage/days:.{PRECISION}f}",
-            f"{RE:.{PRECISION}f}",
-            f"{RE*RE_RETRIEVE_RATIO:.{PRECISION}f}",
-            positive_days,
-            Cell(balance, "balance", CellAlignment.RIGHT)
-        ])
-
-        totalUsage += usage
-        totalRE += RE
-        months += 1
-
-    totalBalance = totalRE * RE_RETRIEVE_RATIO - totalUsage
-
-    if price_kWh is not None and monthly_fixed_cost is not None:
-        energy_cost = round(
-            (-1 * totalBalance * price_kWh if totalBalance < 0 else 0.0), 2)
-        fixed_cost = months * monthly_fixed_cost
-        estimated_cost = energy_cost + fixed_cost
-
-    # Print estimation for current month
-    # We need at least one day of data and we don't need estimations
-    # if we chose to analyse different year then current
-    if dp_date.month == date_today.month and (
-            args.data_year is None or date_today.year == args.data_year):
-
-        days = last_day_of_month(date_today).day
-        # we don't get today data so we need to subtract 1 day
-        ratio = days / (date_today.day - 1)
-
-        table.add_divider()
-        table.add_row([
-            f"Estm-{date_today:%m}",
-            f"{ratio*usage:.{PRECISION}f}",
-            f"{ratio*usage/days:.{PRECISION}f}",
-            f"{ratio*RE:.{PRECISION}f}",
-            f"{ratio*RE*RE_RETRIEVE_RATIO:.{PRECISION}f}",
-            int(ratio*positive_days),
-            Cell(ratio*balance, "balance", CellAlignment.RIGHT)
-        ])
-
-    if args.format == "csv":
-        print(table.to_csv())
-    elif args.format == "json":
-        print(table.to_json())
+    if args.tariffs:
+        from tariffs import parse_tariffs, compare_tariffs, UsageProfile
+        tariffs = parse_tariffs(config)
+
+        # Energy of the whole period is reduced into buckets (hours of
+        # workdays and weekends) once, then all tariffs are evaluated
+        profile = UsageProfile()
+        with PROFILER.phase("tariffs"):
+            if not args.offline:
+                for consume, oze in hourly_data():
+                    profile.add_hourly(consume, oze)
+            elif daily_store is not None:
+                from daily_store import load_monthly_data
+                first_month = period_start.replace(day=1)
+                profile.add_daily(*[
+                    [md for month, md in load_monthly_data(
+                        daily_store, meter_id, data_type).items()
+                     if first_month <= month <= period_end]
+                    for data_type in (DataTypes.consume, DataTypes.oze)])
+            else:
+                start, stop = all_data.bounds(period_start, period_end)
+                profile.add_monthly(all_data[start:stop])
+            costs = compare_tariffs(tariffs, profile)
+
+        if not profile.hourly and any(t.zones > 1 for t in tariffs):
+            print_wrn("Hourly data are available only in online mode, "
+                      "energy is spread evenly over hours of the day.")
+        print_tariff_costs(
+            costs, profile.recorded_tariff, args.format, args.output)
+        PROFILER.add_phase("render", perf_counter() - render_start)
+        exit()
 
-    if args.format is not None:
-        # No summary if we want different format
+    if ranges:
+        compare_ranges(
+            ranges, prefix, daily_prefix, args.format, args.output)
+        PROFILER.add_phase("render", perf_counter() - render_start)
         exit()
 
-    print(table, end="")
+    if args.group is not None:
+        print_groups(
+            all_data, args.group, installation_date, date_today,
+            first_day, last_day, prefix, daily_prefix, ledger, price_kWh,
+            monthly_fixed_cost, args.format, args.output)
+        PROFILER.add_phase("render", perf_counter() - render_start)
+        exit()
 
-    # Print summary
-    print(f"> Total usage:  {totalUsage:{WIDTH}.{PRECISION}f} kWh")
-    print(f"> Total RE:     {totalRE:{WIDTH}.{PRECISION}f} kWh")
-    print(f"> Lost RE:      {totalRE*0.2:{WIDTH}.{PRECISION}f} kWh")
-    print(f"> RE to use:    {totalRE*RE_RETRIEVE_RATIO:{WIDTH}.{PRECISION}f} kWh")
-    print(f"> Balance:      {balance_color(totalBalance, WIDTH, 'kWh')}")
+    # Table, csv and ndjson are written while rows are produced
+    if args.format == "json":
+        table = TableView()
+    else:
+        table = TableView(
+            stream=args.output,
+            stream_format=StreamFormat(args.format or "table"))
+    summary = fill_table(
+        table, all_data, installation_date, date_today,
+        first_day, last_day, prefix)
+    if daily_prefix is not None:
+        # NOTE: Ledger settles whole months only, cost of days is
+        # estimated from their balance
+        summary = daily_prefix.summary(
+            first_day or installation_date, last_day or date_today)
+    elif summary.months:
+        summary.to_pay, summary.banked = ledger.settlement(
+            first_day or all_data[0].month, last_day or all_data[-1].month)
+
+    if args.format == "json":
+        print(table.to_json(), file=args.output)
+    else:
+        table.close()
+    PROFILER.add_phase("render", perf_counter() - render_start)
 
-    if price_kWh is None or monthly_fixed_cost is None:
+    if args.format is not None:
+        # No summary if we want different format
         exit()
-    print(f"> Estim. cost:  {estimated_cost:{WIDTH}.{PRECISION}f} PLN (fix. {fixed_cost:.{PRECISION}f} PLN)")
+
+    # Print summary
+    print_summary(summary, price_kWh, monthly_fixed_cost, args.output)
 
 
 if __name__ == "__main__":
@@ -20,8 +20,19 @@ class Color(StrEnum):
     END = '\033[0m'
 
 
+# Operations taking longer (in seconds) are highlighted in notes
+SLOW_THRESHOLD = 1.0
+
+
+def format_elapsed(seconds: float) -> str:
+    color = Color.PURPLE if seconds >= SLOW_THRESHOLD else Color.BLUE
+    return f"{color}({seconds * 1000:.0f} ms){Color.END}"
+
+
 # TODO: replace with "logging"
-def print_note(*msg: Sequence[Any]) -> None:
+def print_note(*msg: Sequence[Any], elapsed: float | None = None) -> None:
+    if elapsed is not None:
+        msg = (*msg, format_elapsed(elapsed))
     print(f"{Color.BLUE}[NOTE]{Color.END}", *msg, file=sys.stderr)
 
 